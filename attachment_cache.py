@@ -0,0 +1,77 @@
+# attachment_cache.py
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import ATTACHMENT_CACHE_SIZE, ATTACHMENT_TOKEN_TTL_HOURS
+
+
+class AttachmentCache:
+    """
+    Кэш токенов вложений MAX: ключ -> token из /uploads.
+    Повторная отправка того же файла прикрепляет сохранённый token
+    вместо новой загрузки. Записи живут ttl секунд, размер ограничен (LRU).
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._tokens.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        token, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._tokens[key]
+            self.misses += 1
+            return None
+        self._tokens.move_to_end(key)
+        self.hits += 1
+        return token
+
+    def put(self, key: str, token: str) -> None:
+        self._tokens[key] = (token, time.monotonic() + self.ttl)
+        self._tokens.move_to_end(key)
+        while len(self._tokens) > self.max_entries:
+            self._tokens.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        if self._tokens.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._tokens),
+        }
+
+
+def _sha256_file(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def file_digest(file_path: str) -> str:
+    """sha256 файла, считаем в executor'е, чтобы не блокировать loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _sha256_file, file_path)
+
+
+attachment_cache = AttachmentCache(
+    ttl=ATTACHMENT_TOKEN_TTL_HOURS * 3600,
+    max_entries=ATTACHMENT_CACHE_SIZE,
+)
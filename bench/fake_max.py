@@ -0,0 +1,327 @@
+# bench/fake_max.py
+"""
+Локальная замена MAX Bot API для нагрузочного теста.
+
+Сервер сам играет роль пользователей: присылает боту ссылки через
+/updates, «нажимает» кнопки из клавиатур, которые бот отправил или
+вписал правкой в /messages,
+и засекает время до ответа. Загрузки принимаются на /upload/<n>,
+готовность файла имитируется временем обработки, пропорциональным размеру
+(пока не готов — 400 attachment.not.ready), плюс случайные отказы.
+С --rate-limit сервер, как настоящий API, отвечает 429
+на запросы сверх лимита.
+
+Запуск отдельно (обычно его поднимает bench/run.py):
+    python -m bench.fake_max --port 8765 --users 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from httpserver import start_server
+
+MB = 1024 * 1024
+BOT_ID = 1
+
+# тексты бота, которыми заканчивается сценарий пользователя
+FAIL_MARKERS = {
+    "Подожди ещё": "limited",
+    "слишком много загрузок": "rejected",
+    "не хватает места": "rejected",
+    "Не удалось": "error",
+    "Не нашёл": "error",
+    "Ошибка": "error",
+    "Некорректные": "error",
+}
+
+
+class FakeMax:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.base = f"http://{args.host}:{args.port}"
+
+        self._updates: List[Dict[str, Any]] = []
+        self._marker = 0
+        self._has_updates = asyncio.Event()
+
+        self._seq = 0
+        # token -> (готов с момента, размер)
+        self._uploads: Dict[str, Tuple[float, int]] = {}
+        # upload id -> token, выданный заранее в ответе /uploads (audio/video)
+        self._upload_tokens: Dict[str, str] = {}
+        # mid -> user_id: кому принадлежит сообщение, которое правит бот
+        self._message_users: Dict[str, int] = {}
+
+        # сценарий: user_id -> отметки времени и исход
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.counters: Dict[str, int] = {
+            "updates": 0,
+            "messages": 0,
+            "edits": 0,
+            "answers": 0,
+            "uploads": 0,
+            "upload_bytes": 0,
+            "not_ready": 0,
+            "injected_not_ready": 0,
+            "throttled": 0,
+        }
+        # лимит частоты: окно в одну секунду
+        self._window = 0
+        self._window_count = 0
+
+        weights = [1 / (i + 1) ** args.zipf for i in range(args.videos)]
+        self._video_weights = weights
+
+    # ------------------------ сценарий ------------------------ #
+    def _next_id(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _push(self, update: Dict[str, Any]) -> None:
+        self._updates.append(update)
+        self._has_updates.set()
+
+    def _raw_message(self, user_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "recipient": {"chat_id": user_id, "chat_type": "dialog", "user_id": BOT_ID},
+            "sender": {"user_id": user_id, "name": f"user{user_id}"},
+            "body": {"mid": f"mid.{self._next_id()}", "text": text},
+            "timestamp": int(time.time() * 1000),
+        }
+
+    async def _run_users(self) -> None:
+        self.started_at = time.monotonic()
+        interval = self.args.ramp / max(self.args.users, 1)
+        for user_id in range(1, self.args.users + 1):
+            video = self.rng.choices(range(self.args.videos), self._video_weights)[0]
+            url = f"https://www.youtube.com/watch?v=bench{video:06d}"
+            self.users[user_id] = {"link": time.monotonic(), "video": video}
+            self._push({
+                "update_type": "message_created",
+                "timestamp": int(time.time() * 1000),
+                "message": self._raw_message(user_id, url),
+            })
+            await asyncio.sleep(interval)
+
+    async def _press(self, user_id: int, buttons: List[str]) -> None:
+        await asyncio.sleep(self.rng.uniform(0, self.args.think_ms / 1000))
+        payload = buttons[0] if self.args.button == "first" else self.rng.choice(buttons)
+        self.users[user_id]["press"] = time.monotonic()
+        self._push({
+            "update_type": "message_callback",
+            "timestamp": int(time.time() * 1000),
+            "callback": {
+                "callback_id": f"cb.{self._next_id()}",
+                "payload": payload,
+                "user": {"user_id": user_id, "name": f"user{user_id}"},
+            },
+            "message": self._raw_message(user_id, ""),
+        })
+
+    def _finish(self, user_id: int, outcome: str) -> None:
+        user = self.users.get(user_id)
+        if user is None or "outcome" in user:
+            return
+        user["outcome"] = outcome
+        user["done"] = time.monotonic()
+        if len(self.users) == self.args.users and all("outcome" in u for u in self.users.values()):
+            self.finished_at = time.monotonic()
+
+    # ------------------------ API ------------------------ #
+    def _over_limit(self) -> bool:
+        if not self.args.rate_limit:
+            return False
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window, self._window_count = window, 0
+        self._window_count += 1
+        return self._window_count > self.args.rate_limit
+
+    async def _updates_poll(self) -> Dict[str, Any]:
+        if self.started_at is None:
+            asyncio.create_task(self._run_users())
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        updates, self._updates = self._updates, []
+        self._marker += len(updates)
+        self.counters["updates"] += len(updates)
+        return {"updates": updates, "marker": self._marker}
+
+    def _post_message(self, params: Dict[str, str], body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        user_id = int(params.get("user_id") or params.get("chat_id") or 0)
+        now = time.monotonic()
+
+        for att in body.get("attachments") or []:
+            token = (att.get("payload") or {}).get("token")
+            if att.get("type") in ("file", "video", "audio") and token:
+                ready_at, _ = self._uploads.get(token, (0.0, 0))
+                if now < ready_at or self.rng.random() < self.args.not_ready_rate:
+                    self.counters["not_ready" if now < ready_at else "injected_not_ready"] += 1
+                    return 400, {
+                        "code": "attachment.not.ready",
+                        "message": "Key: errors.process.attachment.file.not.processed",
+                    }
+                self._finish(user_id, "ok")
+
+        self._observe(user_id, body, now)
+        self.counters["messages"] += 1
+        message = self._raw_message(user_id, body.get("text") or "")
+        message["sender"] = {"user_id": BOT_ID, "name": "bench_bot", "is_bot": True}
+        self._message_users[message["body"]["mid"]] = user_id
+        return 200, {"message": message}
+
+    def _edit_message(self, params: Dict[str, str], body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        # бот правит своё сообщение: клавиатура и тексты ошибок приходят и так
+        user_id = self._message_users.get(params.get("message_id", ""))
+        if user_id is None:
+            return 404, {"code": "not.found", "message": "message not found"}
+        self.counters["edits"] += 1
+        self._observe(user_id, body, time.monotonic())
+        return 200, {"success": True}
+
+    def _observe(self, user_id: int, body: Dict[str, Any], now: float) -> None:
+        """Клавиатура — пора «нажать» кнопку; текст ошибки — сценарий окончен."""
+        for att in body.get("attachments") or []:
+            if att.get("type") == "inline_keyboard" and user_id in self.users:
+                buttons = [
+                    b["payload"]
+                    for row in att["payload"]["buttons"]
+                    for b in row
+                    if b.get("payload")
+                ]
+                self.users[user_id]["keyboard"] = now
+                if buttons:
+                    asyncio.create_task(self._press(user_id, buttons))
+                else:
+                    self._finish(user_id, "error")
+
+        text = body.get("text") or ""
+        for marker, outcome in FAIL_MARKERS.items():
+            if marker in text:
+                self._finish(user_id, outcome)
+
+    def _new_upload(self, media_type: str) -> Dict[str, Any]:
+        """
+        Как MAX: для audio/video token выдаётся сразу здесь, для file/image —
+        в JSON ответа на саму загрузку.
+        """
+        upload_id = str(self._next_id())
+        result = {"url": f"{self.base}/upload/{upload_id}"}
+        if media_type in ("audio", "video"):
+            result["token"] = self._upload_tokens[upload_id] = f"tok.{self._next_id()}"
+        return result
+
+    def _upload(self, upload_id: str, body: bytes) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Возвращает (token, выданный ещё в /uploads, или None; JSON-ответ загрузки)."""
+        size = len(body)
+        early = self._upload_tokens.pop(upload_id, None)
+        token = early or f"tok.{self._next_id()}"
+        processing = self.args.processing_base + self.args.processing_s_per_mb * size / MB
+        self._uploads[token] = (time.monotonic() + processing, size)
+        self.counters["uploads"] += 1
+        self.counters["upload_bytes"] += size
+        return early, {"token": token}
+
+    async def handle(
+        self, method: str, path: str, query: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, str, bytes]:
+        if path == "/bench/stats":
+            return 200, "application/json", json.dumps(self.stats()).encode()
+
+        if path != "/updates" and self.args.latency_ms:
+            latency = self.args.latency_ms / 1000
+            await asyncio.sleep(self.rng.uniform(latency / 2, latency * 1.5))
+
+        if path != "/updates" and not path.startswith("/upload/") and self._over_limit():
+            self.counters["throttled"] += 1
+            return 429, "application/json", b'{"code":"too.many.requests"}'
+
+        params = {k: v[0] for k, v in parse_qs(query).items()}
+        is_json = headers.get("content-type", "").startswith("application/json")
+        payload = json.loads(body) if body and is_json else {}
+
+        status, result = 200, {"success": True}
+        if path == "/me":
+            result = {"user_id": BOT_ID, "id": BOT_ID, "username": "bench_bot", "is_bot": True}
+        elif path == "/updates":
+            result = await self._updates_poll()
+        elif path == "/messages" and method == "POST":
+            status, result = self._post_message(params, payload)
+        elif path == "/messages" and method == "PUT":
+            status, result = self._edit_message(params, payload)
+        elif path == "/answers":
+            self.counters["answers"] += 1
+        elif path == "/uploads":
+            result = self._new_upload(params.get("type", ""))
+        elif path.startswith("/upload/"):
+            early, result = self._upload(path.rsplit("/", 1)[-1], body)
+            if early:
+                # audio/video: token уже у бота, ответ — не JSON
+                return 200, "text/xml", b"<retval>1</retval>"
+        elif path != "/subscriptions":
+            return 404, "application/json", b'{"code":"not.found"}'
+        return status, "application/json", json.dumps(result).encode()
+
+    # ------------------------ итоги ------------------------ #
+    def stats(self) -> Dict[str, Any]:
+        outcomes: Dict[str, int] = {}
+        keyboard, job, total = [], [], []
+        for user in self.users.values():
+            outcome = user.get("outcome", "pending")
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if "keyboard" in user:
+                keyboard.append(user["keyboard"] - user["link"])
+            if outcome == "ok" and "press" in user:
+                job.append(user["done"] - user["press"])
+                total.append(user["done"] - user["link"])
+        end = self.finished_at or time.monotonic()
+        return {
+            "done": self.finished_at is not None,
+            "elapsed": end - self.started_at if self.started_at else 0.0,
+            "outcomes": outcomes,
+            "counters": self.counters,
+            "latency": {"link_to_keyboard": keyboard, "press_to_file": job, "link_to_file": total},
+        }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Fake MAX Bot API for load tests")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--users", type=int, default=1000, help="сколько пользователей пришлют ссылку")
+    p.add_argument("--ramp", type=float, default=10, help="за сколько секунд приходят все пользователи")
+    p.add_argument("--videos", type=int, default=200, help="сколько разных роликов в выборке")
+    p.add_argument("--zipf", type=float, default=1.0, help="перекос популярности роликов (0 — равномерно)")
+    p.add_argument("--think-ms", type=float, default=500, help="пауза пользователя перед нажатием кнопки")
+    p.add_argument("--button", choices=("first", "random"), default="random")
+    p.add_argument("--latency-ms", type=float, default=20, help="средняя задержка ответа API")
+    p.add_argument("--processing-base", type=float, default=0.2, help="обработка загруженного файла, секунды")
+    p.add_argument("--processing-s-per-mb", type=float, default=0.02)
+    p.add_argument("--not-ready-rate", type=float, default=0.05, help="доля случайных attachment.not.ready")
+    p.add_argument("--rate-limit", type=int, default=0, help="запросов в секунду до 429 (0 — без лимита)")
+    return p.parse_args(argv)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    fake = FakeMax(args)
+    # загрузки приходят целиком в теле запроса
+    server = await start_server(fake.handle, args.host, args.port, max_body=4096 * MB)
+    print(f"[fake_max] listening on {fake.base}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parse_args()))
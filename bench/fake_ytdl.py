@@ -0,0 +1,132 @@
+# bench/fake_ytdl.py
+"""
+Подмена yt-dlp для нагрузочного теста: извлечение и скачивание идут через
+те же очереди и кэши бота (ytdl._extract_formats / ytdl._download_to
+вызываются из пулов scheduler), но вместо сети — пауза и синтетический
+файл нужного размера.
+"""
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import ytdl
+from links import extract_video_id
+from metrics import observe_transfer
+from ytdl import FormatRecord
+
+MB = 1024 * 1024
+WRITE_CHUNK = 1024 * 1024
+
+
+class FakeYtdl:
+    def __init__(
+        self,
+        size_mb: float,
+        extract_ms: float,
+        bandwidth_mbps: float,
+        fail_rate: float = 0.0,
+        sparse: bool = False,
+    ):
+        self.size_mb = size_mb
+        self.extract_ms = extract_ms
+        self.bandwidth = bandwidth_mbps * MB
+        self.fail_rate = fail_rate
+        self.sparse = sparse
+
+    def formats(self, video_id: str) -> List[FormatRecord]:
+        """Стабильный набор форматов для ролика: 360p, 720p и m4a, размер плавает ±50%."""
+        rng = random.Random(video_id)
+        base = int(self.size_mb * MB * rng.uniform(0.5, 1.5))
+        duration = rng.randint(60, 1200)
+        return [
+            FormatRecord(
+                format_id="18",
+                ext="mp4",
+                resolution="640x360",
+                height=360,
+                filesize=base,
+                vcodec="avc1.42001E",
+                acodec="mp4a.40.2",
+                protocol="https",
+                duration=duration,
+            ),
+            FormatRecord(
+                format_id="22",
+                ext="mp4",
+                resolution="1280x720",
+                height=720,
+                filesize=base * 5 // 2,
+                vcodec="avc1.64001F",
+                acodec="mp4a.40.2",
+                protocol="https",
+                duration=duration,
+            ),
+            FormatRecord(
+                format_id="140",
+                ext="m4a",
+                resolution="audio only",
+                abr=129.5,
+                filesize=base // 10,
+                vcodec="none",
+                acodec="mp4a.40.2",
+                protocol="https",
+                duration=duration,
+            ),
+        ]
+
+    def extract_formats(
+        self, url: str
+    ) -> Tuple[Tuple[str, Optional[str], List[FormatRecord]], Optional[float]]:
+        video_id = extract_video_id(url) or "unknown"
+        time.sleep(random.uniform(0.5, 1.5) * self.extract_ms / 1000)
+        if random.random() < self.fail_rate:
+            raise RuntimeError("fake extract failure")
+        title = f"Bench video {video_id}"
+        return (title, f"https://i.ytimg.com/vi/{video_id}/hq.jpg", self.formats(video_id)), None
+
+    def download_to(
+        self,
+        url: str,
+        format_id: str,
+        download_dir: Path,
+        profile: Any = None,
+        audio: Optional[str] = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Path:
+        video_id = extract_video_id(url) or "unknown"
+        fmt = next(f for f in self.formats(video_id) if f.format_id == format_id)
+        size = fmt.filesize
+        started = time.perf_counter()
+        if random.random() < self.fail_rate:
+            raise RuntimeError("fake download failure")
+
+        path = download_dir / f"Bench video {video_id}.{fmt.ext}"
+        with open(path, "wb") as f:
+            if self.sparse:
+                f.truncate(size)
+            else:
+                chunk = b"\0" * WRITE_CHUNK
+                left = size
+                while left > 0:
+                    f.write(chunk[:min(left, WRITE_CHUNK)])
+                    left -= WRITE_CHUNK
+                    if progress:
+                        # как yt-dlp: хук на каждый записанный блок
+                        progress({
+                            "status": "downloading",
+                            "downloaded_bytes": size - max(left, 0),
+                            "total_bytes": size,
+                            "info_dict": {"format_id": format_id},
+                        })
+        # «сеть» медленнее диска — досыпаем до заданной скорости
+        remaining = size / self.bandwidth - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        observe_transfer("download", size, time.perf_counter() - started, format=format_id)
+        return path
+
+    def install(self) -> None:
+        ytdl._extract_formats = self.extract_formats
+        ytdl._download_to = self.download_to
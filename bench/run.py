@@ -0,0 +1,266 @@
+# bench/run.py
+"""
+Нагрузочный тест бота целиком: настоящий main.main() (диспетчер, роутеры,
+очереди, кэши, загрузка в MAX) против локального fake MAX и фейкового yt-dlp.
+
+    python -m bench.run --users 2000 --ramp 20 --size-mb 8
+
+В конце печатает p50/p95/p99 по этапам, задачи в секунду, пиковый RSS
+и число открытых дескрипторов. --json сохраняет сырые итоги, чтобы сравнивать
+прогоны до и после изменения.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MB = 1024 * 1024
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="End-to-end load test against a fake MAX API")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--ramp", type=float, default=10)
+    p.add_argument("--videos", type=int, default=200)
+    p.add_argument("--zipf", type=float, default=1.0)
+    p.add_argument("--think-ms", type=float, default=500)
+    p.add_argument("--button", choices=("first", "random"), default="random")
+    p.add_argument("--latency-ms", type=float, default=20)
+    p.add_argument("--processing-base", type=float, default=0.2)
+    p.add_argument("--processing-s-per-mb", type=float, default=0.02)
+    p.add_argument("--not-ready-rate", type=float, default=0.05)
+    p.add_argument("--rate-limit", type=int, default=0, help="лимит fake MAX, запросов в секунду")
+    p.add_argument("--api-rate", type=float, default=0, help="API_RATE бота (0 — без своего лимита)")
+    p.add_argument("--size-mb", type=float, default=4, help="средний размер 360p-формата")
+    p.add_argument("--extract-ms", type=float, default=300, help="время извлечения форматов")
+    p.add_argument("--bandwidth-mbps", type=float, default=50, help="скорость «скачивания», МБ/с")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="доля падений extract/download")
+    p.add_argument("--sparse", action="store_true", help="разреженные файлы вместо записи нулей")
+    p.add_argument("--timeout", type=float, default=600, help="предел всего прогона, секунды")
+    p.add_argument("--json", help="куда сохранить итоги в JSON")
+    p.add_argument("--verbose", action="store_true", help="не глушить print() бота")
+    return p.parse_args()
+
+
+def _setup_env(args: argparse.Namespace, download_dir: str) -> None:
+    # всё, что читает config.py, — до первого импорта модулей бота
+    os.environ["BOT_TOKEN"] = "bench-token"
+    os.environ["DOWNLOAD_DIR"] = download_dir
+    os.environ["UPDATES_MODE"] = "polling"
+    os.environ["EXTRACT_BACKEND"] = "thread"
+    os.environ["PIPELINE_UPLOADS"] = "0"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["YOUTUBE_NEXT_FETCH"] = "0"
+    os.environ["API_RATE"] = str(args.api_rate)
+    os.environ.setdefault("LIMITS_BACKEND", "memory")
+    os.environ.setdefault("TOKEN_STORE_BACKEND", "memory")
+    os.environ.setdefault("JOURNAL_BACKEND", "memory")
+    # прогон — как раз диагностика: лаг event loop попадает в отчёт
+    os.environ.setdefault("WATCHDOG_ENABLED", "1")
+
+
+def _fake_max_argv(args: argparse.Namespace) -> List[str]:
+    argv = [sys.executable, "-m", "bench.fake_max"]
+    for name in (
+        "port", "users", "ramp", "videos", "zipf", "think_ms", "button",
+        "latency_ms", "processing_base", "processing_s_per_mb", "not_ready_rate", "rate_limit",
+    ):
+        argv += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    return argv
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class ResourceSampler:
+    """Пиковые RSS / открытые fd / потоки процесса бота."""
+
+    def __init__(self) -> None:
+        self.peak_fds = 0
+        self.peak_threads = 0
+
+    def sample(self) -> None:
+        try:
+            fds = len(os.listdir("/proc/self/fd"))
+        except OSError:
+            fds = 0
+        self.peak_fds = max(self.peak_fds, fds)
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    @staticmethod
+    def peak_rss_mb() -> float:
+        # ru_maxrss на Linux в КБ, на macOS в байтах
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (MB if sys.platform == "darwin" else 1024)
+
+
+def check_download_opts() -> None:
+    """
+    Фейковый yt-dlp настоящих опций скачивания не видит — прогоняем их
+    через RetryManager yt-dlp: так он зовёт retry_sleep_functions на
+    первой же ошибке сети или фрагмента.
+    """
+    import ytdl
+    from yt_dlp.utils import RetryManager
+
+    opts = ytdl._build_download_opts(Path(tempfile.gettempdir()), "18")
+    for kind, sleep_func in opts["retry_sleep_functions"].items():
+        errors = iter([OSError(f"{kind}: transient error")])
+        for retry in RetryManager(
+            1, RetryManager.report_retry,
+            sleep_func=sleep_func, info=lambda _: None, warn=lambda _: None,
+        ):
+            retry.error = next(errors, None)
+
+
+async def _wait_ready(base: str, client: httpx.AsyncClient) -> None:
+    for _ in range(100):
+        try:
+            await client.get(f"{base}/bench/stats")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("fake MAX не поднялся")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import main
+    import metrics
+    import mybot
+    from bench.fake_ytdl import FakeYtdl
+    from watchdog import watchdog
+
+    base = f"http://127.0.0.1:{args.port}"
+    mybot.Bot.BASE_URL = base
+    FakeYtdl(
+        args.size_mb, args.extract_ms, args.bandwidth_mbps, args.fail_rate, args.sparse
+    ).install()
+
+    # сырые длительности этапов — гистограмма сама по себе даёт только бакеты
+    stages: Dict[str, List[float]] = {}
+    observe = metrics.stage_seconds.observe
+
+    def record(value: float, **labels: str) -> None:
+        stages.setdefault(labels.get("stage", ""), []).append(value)
+        observe(value, **labels)
+
+    metrics.stage_seconds.observe = record
+
+    sampler = ResourceSampler()
+    bot_task = asyncio.create_task(main.main())
+    stats: Dict[str, Any] = {}
+    async with httpx.AsyncClient() as client:
+        await _wait_ready(base, client)
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and not bot_task.done():
+            sampler.sample()
+            stats = (await client.get(f"{base}/bench/stats")).json()
+            if stats["done"]:
+                break
+            await asyncio.sleep(0.5)
+
+    bot_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await bot_task
+
+    ok = stats.get("outcomes", {}).get("ok", 0)
+    elapsed = stats.get("elapsed") or 0.0
+    return {
+        "args": vars(args),
+        "elapsed": elapsed,
+        "completed": stats.get("done", False),
+        "outcomes": stats.get("outcomes", {}),
+        "jobs_per_second": ok / elapsed if elapsed else 0.0,
+        "stages": stages,
+        "latency": stats.get("latency", {}),
+        "api": stats.get("counters", {}),
+        "peak_rss_mb": sampler.peak_rss_mb(),
+        "peak_fds": sampler.peak_fds,
+        "peak_threads": sampler.peak_threads,
+        "loop": watchdog.stats(),
+        "slowest": [(site, entry["count"], entry["seconds"]) for site, entry in watchdog.slowest()[:3]],
+    }
+
+
+def report(result: Dict[str, Any]) -> str:
+    lines = []
+    outcomes = ", ".join(f"{k} {v}" for k, v in sorted(result["outcomes"].items()))
+    status = "" if result["completed"] else " (НЕ ЗАВЕРШЁН: таймаут)"
+    lines.append(f"users {result['args']['users']}, {result['elapsed']:.1f}s{status}: {outcomes}")
+    lines.append(f"jobs/s {result['jobs_per_second']:.2f}")
+    lines.append("")
+    lines.append(f"{'stage':<18}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(result["stages"].items()) + list(result["latency"].items())
+    for name, values in rows:
+        lines.append(
+            f"{name:<18}{len(values):>7}"
+            + "".join(f"{percentile(values, q):>9.3f}" for q in (50, 95, 99))
+        )
+    lines.append("")
+    lines.append(
+        f"peak RSS {result['peak_rss_mb']:.1f} MB, peak fds {result['peak_fds']},"
+        f" peak threads {result['peak_threads']}"
+    )
+    loop = result["loop"]
+    lines.append(
+        f"loop lag p50 {loop['p50_ms']} ms, p99 {loop['p99_ms']} ms, max {loop['max_ms']} ms,"
+        f" stalls {loop['stalls']}"
+    )
+    for site, count, seconds in result["slowest"]:
+        lines.append(f"  blocked {seconds:.3f}s in {count}x: {site}")
+    api = result["api"]
+    if api:
+        lines.append(
+            f"api: uploads {api['uploads']} ({api['upload_bytes'] / MB:.0f} MB),"
+            f" messages {api['messages']}, edits {api['edits']}, answers {api['answers']},"
+            f" not.ready {api['not_ready']} + injected {api['injected_not_ready']},"
+            f" 429 {api['throttled']}"
+        )
+    return "\n".join(lines)
+
+
+def cli() -> None:
+    args = parse_args()
+    download_dir = tempfile.mkdtemp(prefix="ytbot_bench_")
+    _setup_env(args, download_dir)
+    sys.path.insert(0, str(BASE_DIR))
+
+    check_download_opts()
+    fake = subprocess.Popen(_fake_max_argv(args), cwd=BASE_DIR)
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            result = asyncio.run(run(args))
+    finally:
+        fake.terminate()
+        fake.wait()
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+    print(report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f)
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,11 +2,15 @@
 
 import asyncio
 import os
-import tempfile
-from typing import Tuple
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import yt_dlp  # не забудь добавить в requirements.txt
 
+from progress import StatusMessage, upload_progress
+from scheduler import scheduler
+from spool import spool
+
 from maxbot.router import Router
 from maxbot.dispatcher import get_current_dispatcher
 from maxbot.filters import TextStartsFilter
@@ -36,11 +40,18 @@ def parse_yt_callback(data: str) -> Tuple[str, str, str]:
 
 
 # ------------------------ хелпер для скачивания ------------------------ #
-async def download_with_yt_dlp(url: str, itag: str) -> str:
+async def download_with_yt_dlp(
+    url: str,
+    itag: str,
+    user_id: int,
+    tmp_dir: Path,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> str:
     """
-    Скачивает выбранный формат в tmp-файл и возвращает путь к нему.
+    Скачивает выбранный формат в tmp_dir и возвращает путь к файлу.
+    Каталог создаёт и удаляет вызывающий (spool.job).
+    progress — progress_hook yt-dlp (см. StatusMessage.download_hook).
     """
-    tmp_dir = tempfile.mkdtemp(prefix="ytbot_")
     out_tmpl = os.path.join(tmp_dir, "%(title)s.%(ext)s")
 
     ydl_opts = {
@@ -49,14 +60,15 @@ async def download_with_yt_dlp(url: str, itag: str) -> str:
         "noprogress": True,
         "format": itag,  # выбираем формат по itag
     }
+    if progress:
+        ydl_opts["progress_hooks"] = [progress]
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(
-        None,
+    await scheduler.run_download(
+        user_id,
         lambda: yt_dlp.YoutubeDL(ydl_opts).download([url]),
     )
 
-    files = os.listdir(tmp_dir)
+    files = await asyncio.to_thread(os.listdir, tmp_dir)
     if not files:
         raise RuntimeError("Файл не был скачан")
 
@@ -96,51 +108,37 @@ async def youtube_format_chosen(cb: Callback):
         notification="Начал загрузку…",
     )
 
-    # 3. Сообщаем пользователю в чат
-    await bot.send_message(
-        user_id=user_id,
-        text="⏬ Скачиваю файл, подожди немного…",
-    )
+    # 3. Сообщаем пользователю в чат — дальше это сообщение показывает прогресс
+    status = StatusMessage(bot, user_id)
+    await status.show("⏬ Скачиваю файл, подожди немного…")
+    upload_progress.set(status.upload_hook)
 
-    file_path = None
     try:
-        # 4. Скачиваем выбранный формат
-        file_path = await download_with_yt_dlp(url, itag)
-
-        caption = (
-            "✅ Готово! Вот твоё видео."
-            if kind == "video"
-            else "✅ Готово! Вот твой аудио-файл."
-        )
-        media_type = "video" if kind == "video" else "audio"
-
-        # 5. Отправляем файл пользователю
-        await bot.send_file(
-            file_path=file_path,
-            media_type=media_type,
-            user_id=user_id,
-            text=caption,
-        )
+        # 4. Скачиваем выбранный формат в каталог задачи: spool.job удалит
+        # его вместе с файлом и хвостами .part, даже если yt-dlp упал
+        async with spool.job(None, prefix="ytbot_") as tmp_dir:
+            file_path = await download_with_yt_dlp(
+                url, itag, user_id, tmp_dir, status.download_hook()
+            )
+
+            caption = (
+                "✅ Готово! Вот твоё видео."
+                if kind == "video"
+                else "✅ Готово! Вот твой аудио-файл."
+            )
+            media_type = "video" if kind == "video" else "audio"
+
+            # 5. Отправляем файл пользователю
+            resp = await bot.send_file(
+                file_path=file_path,
+                media_type=media_type,
+                user_id=user_id,
+                text=caption,
+            )
+            if resp.status_code >= 400:
+                raise RuntimeError(f"MAX не принял файл (HTTP {resp.status_code})")
+        await status.show("Файл отправлен 👇")
 
     except Exception as e:
         # Если что-то пошло не так — шлём текстом
-        await bot.send_message(
-            user_id=user_id,
-            text=f"❌ Ошибка при загрузке: {e}",
-        )
-    finally:
-        # 6. Чистим временный файл/папку
-        if file_path:
-            try:
-                tmp_dir = os.path.dirname(file_path)
-                try:
-                    os.remove(file_path)
-                except FileNotFoundError:
-                    pass
-                try:
-                    os.rmdir(tmp_dir)
-                except OSError:
-                    # если вдруг ещё что-то осталось — просто забьём
-                    pass
-            except Exception:
-                pass
+        await status.show(f"❌ Ошибка при загрузке: {e}")
@@ -1,4 +1,5 @@
 import os
+import socket
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -11,6 +12,137 @@ if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не задан в .env")
 
 YOUTUBE_NEXT_FETCH_MINUTES: int = int(os.getenv("YOUTUBE_NEXT_FETCH", 3))
+# сколько ссылок из одного сообщения разбираем (остальные игнорируем)
+MAX_LINKS_PER_MESSAGE: int = int(os.getenv("MAX_LINKS_PER_MESSAGE", 5))
 
 DOWNLOAD_DIR: Path = BASE_DIR / os.getenv("DOWNLOAD_DIR", "downloads")
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# логи: уровень, формат (text/json), обрезка длинных полей, доля
+# записываемых частых событий (попытки отправки и т.п.)
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")
+LOG_FIELD_MAX: int = int(os.getenv("LOG_FIELD_MAX", 500))
+LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+
+# постоянный кэш скачанных файлов (video_id + format_id -> файл)
+MEDIA_CACHE_DIR: Path = DOWNLOAD_DIR / "cache"
+MEDIA_CACHE_MAX_MB: int = int(os.getenv("MEDIA_CACHE_MAX_MB", 5120))
+
+# диск под загрузки: потолок занятого места, запас свободного места,
+# возраст брошенных файлов и период уборки
+SPOOL_DIR: Path = DOWNLOAD_DIR / "jobs"
+SPOOL_MAX_MB: int = int(os.getenv("SPOOL_MAX_MB", 10240))
+SPOOL_MIN_FREE_MB: int = int(os.getenv("SPOOL_MIN_FREE_MB", 1024))
+SPOOL_DEFAULT_JOB_MB: int = int(os.getenv("SPOOL_DEFAULT_JOB_MB", 100))
+SPOOL_ORPHAN_HOURS: float = float(os.getenv("SPOOL_ORPHAN_HOURS", 6))
+SPOOL_SWEEP_MINUTES: float = float(os.getenv("SPOOL_SWEEP_MINUTES", 15))
+
+# кэш токенов вложений MAX (повторная отправка без новой загрузки)
+ATTACHMENT_TOKEN_TTL_HOURS: float = float(os.getenv("ATTACHMENT_TOKEN_TTL_HOURS", 24))
+ATTACHMENT_CACHE_SIZE: int = int(os.getenv("ATTACHMENT_CACHE_SIZE", 10000))
+
+# кэш метаданных роликов (список форматов по video_id)
+META_CACHE_TTL_MINUTES: float = float(os.getenv("META_CACHE_TTL_MINUTES", 30))
+META_CACHE_SIZE: int = int(os.getenv("META_CACHE_SIZE", 2000))
+
+# пулы потоков yt-dlp и очередь загрузок
+EXTRACT_WORKERS: int = int(os.getenv("EXTRACT_WORKERS", 4))
+DOWNLOAD_WORKERS: int = int(os.getenv("DOWNLOAD_WORKERS", 3))
+DOWNLOAD_QUEUE_SIZE: int = int(os.getenv("DOWNLOAD_QUEUE_SIZE", 100))
+DOWNLOAD_QUEUE_PER_USER: int = int(os.getenv("DOWNLOAD_QUEUE_PER_USER", 3))
+
+# загрузка файлов в MAX: общий пул соединений и таймауты (секунды)
+UPLOAD_MAX_CONNECTIONS: int = int(os.getenv("UPLOAD_MAX_CONNECTIONS", 32))
+UPLOAD_CHUNK_KB: int = int(os.getenv("UPLOAD_CHUNK_KB", 512))
+UPLOAD_CONNECT_TIMEOUT: float = float(os.getenv("UPLOAD_CONNECT_TIMEOUT", 10))
+UPLOAD_WRITE_TIMEOUT: float = float(os.getenv("UPLOAD_WRITE_TIMEOUT", 60))
+UPLOAD_READ_TIMEOUT: float = float(os.getenv("UPLOAD_READ_TIMEOUT", 300))
+# потолок размера файла для MAX (кнопка «лучшее качество» в него укладывается)
+UPLOAD_MAX_MB: int = int(os.getenv("UPLOAD_MAX_MB", 2048))
+# файл больше потолка режется на части (нужен ffmpeg); сколько частей грузить одновременно
+UPLOAD_PARALLEL_PARTS: int = int(os.getenv("UPLOAD_PARALLEL_PARTS", 3))
+
+# сетевой движок yt-dlp: профиль выбирается по протоколу и размеру формата
+DL_LARGE_MB: int = int(os.getenv("DL_LARGE_MB", 150))
+DL_FRAGMENTS: int = int(os.getenv("DL_FRAGMENTS", 2))
+DL_FRAGMENTS_LARGE: int = int(os.getenv("DL_FRAGMENTS_LARGE", 8))
+DL_CONNECTION_BUDGET: int = int(os.getenv("DL_CONNECTION_BUDGET", 24))
+DL_HTTP_CHUNK_MB: int = int(os.getenv("DL_HTTP_CHUNK_MB", 10))
+DL_BUFFER_KB: int = int(os.getenv("DL_BUFFER_KB", 1024))
+DL_RETRIES: int = int(os.getenv("DL_RETRIES", 10))
+DL_FRAGMENT_RETRIES: int = int(os.getenv("DL_FRAGMENT_RETRIES", 10))
+DL_EXTERNAL_DOWNLOADER: str = os.getenv("DL_EXTERNAL_DOWNLOADER", "")
+
+# потоковый режим: скачивание и загрузка в MAX одновременно (для цельных форматов)
+PIPELINE_UPLOADS: bool = os.getenv("PIPELINE_UPLOADS", "0").lower() in ("1", "true", "yes")
+PIPELINE_BUFFER_MB: int = int(os.getenv("PIPELINE_BUFFER_MB", 16))
+PIPELINE_CHUNK_KB: int = int(os.getenv("PIPELINE_CHUNK_KB", 256))
+
+# извлечение метаданных: "thread" — пул потоков, "process" — пул процессов
+EXTRACT_BACKEND: str = os.getenv("EXTRACT_BACKEND", "thread")
+EXTRACT_PROCESSES: int = int(os.getenv("EXTRACT_PROCESSES", os.cpu_count() or 2))
+EXTRACT_MAX_TASKS_PER_CHILD: int = int(os.getenv("EXTRACT_MAX_TASKS_PER_CHILD", 50))
+
+# общие данные бота (SQLite), можно вынести на общий для нескольких процессов том
+DATA_DIR: Path = BASE_DIR / os.getenv("DATA_DIR", "data")
+
+# лимит частоты загрузок: "memory" — в процессе, "sqlite" — общий для процессов
+LIMITS_BACKEND: str = os.getenv("LIMITS_BACKEND", "memory")
+LIMITS_DB: Path = DATA_DIR / "limits.sqlite3"
+
+# токены inline-клавиатур (callback_data -> ссылка и форматы)
+TOKEN_STORE_BACKEND: str = os.getenv("TOKEN_STORE_BACKEND", "memory")
+TOKEN_STORE_DB: Path = DATA_DIR / "tokens.sqlite3"
+TOKEN_TTL_HOURS: float = float(os.getenv("TOKEN_TTL_HOURS", 24))
+TOKEN_STORE_SIZE: int = int(os.getenv("TOKEN_STORE_SIZE", 50000))
+
+# журнал задач: незаконченные загрузки продолжаются после рестарта
+# ("memory" — без журнала между запусками); сколько раз пробуем
+# продолжить задачу и задачи старше скольких часов бросаем
+# при общем DATA_DIR у каждого процесса свой INSTANCE_ID (по умолчанию имя
+# хоста): после рестарта процесс поднимает только свои задачи
+JOURNAL_BACKEND: str = os.getenv("JOURNAL_BACKEND", "sqlite")
+JOURNAL_DB: Path = DATA_DIR / "jobs.sqlite3"
+INSTANCE_ID: str = os.getenv("INSTANCE_ID", socket.gethostname())
+JOURNAL_MAX_ATTEMPTS: int = int(os.getenv("JOURNAL_MAX_ATTEMPTS", 3))
+JOURNAL_MAX_AGE_HOURS: float = float(os.getenv("JOURNAL_MAX_AGE_HOURS", 6))
+
+# приём апдейтов: "polling" или "webhook"
+UPDATES_MODE: str = os.getenv("UPDATES_MODE", "polling")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")  # публичный адрес, если задан — подписываемся сами
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Prometheus-метрики (0 — выключены)
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = int(os.getenv("METRICS_PORT", 9108))
+
+# диагностика event loop (по умолчанию выключена): лаг таймера каждые
+# WATCHDOG_INTERVAL_MS, остановки дольше WATCHDOG_BLOCK_MS — со стеком
+# (рейтинг на /debug/loop рядом с /metrics)
+WATCHDOG_ENABLED: bool = os.getenv("WATCHDOG_ENABLED", "0").lower() in ("1", "true", "yes")
+WATCHDOG_INTERVAL_MS: int = int(os.getenv("WATCHDOG_INTERVAL_MS", 100))
+WATCHDOG_BLOCK_MS: int = int(os.getenv("WATCHDOG_BLOCK_MS", 250))
+WATCHDOG_TOP: int = int(os.getenv("WATCHDOG_TOP", 20))
+
+# исходящие запросы к MAX API: запросов в секунду (0 — без лимита), всплеск, повторы
+# после 429/5xx и потолок паузы между ними (секунды)
+API_RATE: float = float(os.getenv("API_RATE", 25))
+API_BURST: int = int(os.getenv("API_BURST", 10))
+API_MAX_RETRIES: int = int(os.getenv("API_MAX_RETRIES", 5))
+API_MAX_BACKOFF: float = float(os.getenv("API_MAX_BACKOFF", 30))
+
+# сообщение о ходе задачи: не чаще одной правки в PROGRESS_EDIT_SECONDS
+# и только при сдвиге на PROGRESS_MIN_STEP процентов
+PROGRESS_EDIT_SECONDS: float = float(os.getenv("PROGRESS_EDIT_SECONDS", 3))
+PROGRESS_MIN_STEP: int = int(os.getenv("PROGRESS_MIN_STEP", 5))
+
+# ожидание готовности вложения после загрузки (секунды)
+ATTACH_BASE_DELAY: float = float(os.getenv("ATTACH_BASE_DELAY", 0.3))
+ATTACH_SECONDS_PER_MB: float = float(os.getenv("ATTACH_SECONDS_PER_MB", 0.05))
+ATTACH_MAX_DELAY: float = float(os.getenv("ATTACH_MAX_DELAY", 10))
+ATTACH_DEADLINE: float = float(os.getenv("ATTACH_DEADLINE", 120))
@@ -7,6 +7,10 @@ from maxbot.bot import Bot
 from maxbot.dispatcher import Dispatcher, get_current_dispatcher
 from maxbot import types
 
+from logs import get_logger
+
+log = get_logger("core")
+
 load_dotenv()
 TOKEN = os.getenv("MAX_BOT_TOKEN")
 if not TOKEN:
@@ -74,17 +78,12 @@ def extract_chat_id(msg):
     if fallback is not None:
         return fallback
 
-    # отладка
-    try:
-        print("[extract_chat_id][DEBUG] msg.__dict__:", getattr(msg, "__dict__", None))
-    except Exception:
-        pass
-    try:
-        raw = getattr(msg, "raw", None)
-        if raw is not None:
-            print("[extract_chat_id][DEBUG] msg.raw keys:", list(raw.keys()))
-            print("[extract_chat_id][DEBUG] msg.raw:", raw)
-    except Exception:
-        pass
+    # отладка: только ключи, без содержимого сообщения
+    raw = getattr(msg, "raw", None)
+    log.debug(
+        "extract_chat_id failed",
+        attrs=sorted(getattr(msg, "__dict__", {}) or {}),
+        raw_keys=sorted(raw) if isinstance(raw, dict) else None,
+    )
 
     raise AttributeError("Не удалось извлечь chat_id")
@@ -0,0 +1,16 @@
+# db.py
+import sqlite3
+from pathlib import Path
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """
+    SQLite-соединение для общих между процессами данных бота:
+    WAL (читатели не ждут писателя), autocommit и ожидание блокировки
+    вместо мгновенного "database is locked".
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,106 @@
+# extract_pool.py
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Optional
+
+from config import EXTRACT_BACKEND, EXTRACT_MAX_TASKS_PER_CHILD, EXTRACT_PROCESSES
+from logs import get_logger
+
+log = get_logger("extract_pool")
+
+# ------------------------ код внутри процесса-воркера ------------------------ #
+# один YoutubeDL на процесс: extractor'ы, кэш nsig/подписей и импорт yt_dlp
+# переживают задачи, а не создаются заново на каждую ссылку
+_worker_ydl: Any = None
+
+
+def _init_worker() -> None:
+    global _worker_ydl
+    from yt_dlp import YoutubeDL
+
+    import ytdl
+
+    _worker_ydl = YoutubeDL(ytdl.YDL_EXTRACT_OPTS)
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+def _extract_in_worker(url: str):
+    import ytdl
+
+    info = _worker_ydl.extract_info(url, download=False)
+    # назад по IPC уходит только компактный список форматов
+    return ytdl.compact_info(info)
+
+
+# ------------------------ сторона бота ------------------------ #
+class ProcessExtractor:
+    """
+    Извлечение метаданных в пуле процессов, чтобы CPU-тяжёлая часть yt-dlp
+    (JS-интерпретатор nsig, разбор больших JSON) не упиралась в GIL и не
+    тормозила event loop. Воркеры прогреваются заранее и пересоздаются
+    после max_tasks_per_child задач, чтобы не копить память.
+    """
+
+    def __init__(self, enabled: bool, processes: int, max_tasks_per_child: int):
+        self.enabled = enabled
+        self.processes = processes
+        self.max_tasks_per_child = max_tasks_per_child
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _make_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            # max_tasks_per_child не работает с fork, spawn ещё и безопаснее с потоками
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+
+    async def start(self) -> None:
+        """
+        Поднимает все воркеры сразу, чтобы первая ссылка не ждала импорт yt_dlp:
+        каждая отправленная задача при отсутствии свободного воркера порождает
+        новый процесс, а initializer отрабатывает в каждом из них.
+        """
+        if not self.enabled or self._pool is not None:
+            return
+        self._pool = self._make_pool()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._pool, _warmup) for _ in range(self.processes))
+        )
+        log.info("started worker processes", processes=self.processes)
+
+    async def extract(self, url: str):
+        if self._pool is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, _extract_in_worker, url)
+        except BrokenProcessPool:
+            # воркер упал (OOM и т.п.) — пересоздаём пул для следующих задач;
+            # только если его ещё не пересоздал сосед с той же ошибкой,
+            # иначе погасим новый пул вместе с задачами в нём
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._make_pool()
+            raise
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+process_extractor = ProcessExtractor(
+    enabled=EXTRACT_BACKEND == "process",
+    processes=EXTRACT_PROCESSES,
+    max_tasks_per_child=EXTRACT_MAX_TASKS_PER_CHILD,
+)
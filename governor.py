@@ -0,0 +1,204 @@
+# governor.py
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from logs import get_logger
+from metrics import api_queue_wait, api_request_seconds, api_retries
+
+log = get_logger("governor")
+
+# приоритеты: меньше — раньше
+PRIORITY_CALLBACK = 0  # ответ на нажатие кнопки — пользователь ждёт «часики»
+PRIORITY_MESSAGE = 1  # тексты, клавиатуры, правки статуса
+PRIORITY_BULK = 2  # всё, что связано с файлами: /uploads и сообщения с вложениями
+
+PRIORITY_NAMES = {PRIORITY_CALLBACK: "callback", PRIORITY_MESSAGE: "message", PRIORITY_BULK: "bulk"}
+
+# ответы, после которых запрос можно смело повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_after(resp: httpx.Response) -> Optional[float]:
+    """Retry-After в секундах (число или HTTP-дата), None — заголовка нет."""
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestGovernor:
+    """
+    Единая очередь исходящих запросов к MAX API.
+
+    - token bucket: не больше rate запросов в секунду, всплеск до burst;
+    - свободные токены раздаются по приоритету (callback > message > bulk),
+      внутри приоритета — по очереди прихода;
+    - запросы в один чат идут строго по порядку: следующий ждёт ответа
+      на предыдущий;
+    - 429/5xx повторяются с паузой из Retry-After (иначе экспоненциальной),
+      а 429 ещё и придерживает всю очередь на эту паузу.
+
+    Время в очереди и время самого запроса пишутся в разные метрики —
+    так видно, тормозит ли наш лимит или эндпоинт.
+    """
+
+    def __init__(self, rate: float, burst: int, max_retries: int, max_backoff: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # chat -> [lock, сколько запросов ждут или держат его]
+        self._chats: Dict[str, list] = {}
+
+        self.throttled = 0
+        self.retried = 0
+
+    # ------------------------ token bucket ------------------------ #
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        else:
+            self._tokens = float(self.burst)
+        self._updated = now
+
+    def _ready(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= 1 and now >= self._paused_until
+
+    def _dispatch(self) -> None:
+        """Раздаёт доступные токены ожидающим и заводит таймер на следующий."""
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающего отменили
+                continue
+            self._tokens -= 1
+            fut.set_result(None)
+
+        if self._waiters and self._timer is None:
+            delay = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate > 0 else 0)
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    async def _acquire(self, priority: int) -> float:
+        """Ждёт токен; возвращает, сколько секунд простояли в очереди."""
+        started = time.monotonic()
+        if not self._waiters and self._ready(started):
+            self._tokens -= 1
+            return 0.0
+
+        self.throttled += 1
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()
+        await fut
+        return time.monotonic() - started
+
+    def pause(self, seconds: float) -> None:
+        """Придержать все запросы (сервер ответил 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    # ------------------------ порядок в чате ------------------------ #
+    @asynccontextmanager
+    async def _chat_turn(self, chat: Optional[str]) -> AsyncIterator[None]:
+        if chat is None:
+            yield
+            return
+        entry = self._chats.get(chat)
+        if entry is None:
+            entry = self._chats[chat] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке прихода
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat]
+
+    # ------------------------ запрос ------------------------ #
+    def _backoff(self, resp: httpx.Response, attempt: int) -> float:
+        delay = retry_after(resp)
+        if delay is None:
+            delay = min(self.max_backoff, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        return min(delay, self.max_backoff)
+
+    async def call(
+        self,
+        send: Callable[[], Awaitable[httpx.Response]],
+        priority: int = PRIORITY_MESSAGE,
+        chat: Optional[str] = None,
+        endpoint: str = "",
+    ) -> httpx.Response:
+        """
+        Выполняет send() в свою очередь. Ответ 429/5xx повторяется
+        до max_retries раз; последний ответ возвращается как есть.
+        """
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        attempt = 0
+        # чат держим и на время пауз между повторами — иначе следующее
+        # сообщение обгонит то, что ещё повторяется
+        async with self._chat_turn(chat):
+            while True:
+                attempt += 1
+                waited = await self._acquire(priority)
+                api_queue_wait.observe(waited, endpoint=endpoint, priority=name)
+                started = time.perf_counter()
+                resp = await send()
+                api_request_seconds.observe(
+                    time.perf_counter() - started, endpoint=endpoint, status=str(resp.status_code)
+                )
+
+                if resp.status_code not in RETRY_STATUSES or attempt > self.max_retries:
+                    return resp
+
+                delay = self._backoff(resp, attempt)
+                if resp.status_code == 429:
+                    self.pause(delay)
+                self.retried += 1
+                api_retries.inc(endpoint=endpoint, status=str(resp.status_code))
+                log.warning(
+                    "api retry",
+                    endpoint=endpoint,
+                    status=resp.status_code,
+                    attempt=attempt,
+                    delay=round(delay, 2),
+                )
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        self._refill(time.monotonic())
+        return {
+            "waiting": len(self._waiters),
+            "tokens": int(self._tokens),
+            "chats": len(self._chats),
+            "throttled": self.throttled,
+            "retried": self.retried,
+        }
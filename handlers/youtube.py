@@ -1,8 +1,12 @@
 # handlers/youtube.py
 
+import asyncio
+import shutil
+import time
+from contextlib import AsyncExitStack
 from pathlib import Path
+from typing import List
 from uuid import uuid4
-from typing import Dict
 
 from maxbot.router import Router
 from maxbot.filters import TextStartsFilter
@@ -14,31 +18,84 @@ from maxbot.types import (
 )
 from maxbot.dispatcher import get_current_dispatcher
 
-from limits import check_limit, set_limit
-from ytdl import prepare_formats, download_selected_format, human_bytes
+from config import (
+    JOURNAL_MAX_AGE_HOURS,
+    JOURNAL_MAX_ATTEMPTS,
+    MAX_LINKS_PER_MESSAGE,
+    PIPELINE_UPLOADS,
+    UPLOAD_MAX_MB,
+)
+from journal import JobRecord, journal
+from limits import acquire_limit, release_limit
+from logs import bind, get_logger
+from links import canonical_url, extract_video_id, extract_video_ids
+from media_cache import media_cache
+from metrics import errors, job_format
+from mybot import PartRejected
+from pipeline import can_pipeline, send_pipelined
+from progress import StatusMessage, upload_progress
+from scheduler import QueueFull, scheduler
+from spool import SpoolFull, spool
+from token_store import token_store
+from ytdl import (
+    FFMPEG,
+    MB,
+    FormatRecord,
+    audio_target,
+    is_audio_only,
+    is_merged,
+    prepare_formats,
+    download_to_dir,
+    find_cached_format,
+    human_bytes,
+    split_for_upload,
+)
 
 
 router = Router()
+log = get_logger("youtube")
 
-YOUTUBE_DOMAINS = ("youtube.com", "youtu.be")
-DOWNLOAD_CACHE: Dict[str, str] = {}
 
+def _oversize(f: FormatRecord) -> bool:
+    return f.size > UPLOAD_MAX_MB * MB
 
-def _build_formats_keyboard(formats, url: str) -> InlineKeyboardMarkup:
+
+def _build_formats_keyboard(formats: List[FormatRecord], url: str) -> InlineKeyboardMarkup:
     """
     На основе списка форматов собираем inline-клавиатуру.
     callback_data: yt|token|format_id
-    URL храним отдельно в DOWNLOAD_CACHE[token] = url.
+    Один токен на всю клавиатуру: в token_store лежат URL и предложенные форматы.
+    Форматы больше потолка MAX приходят частями (✂️); без ffmpeg резать
+    нечем — такие не предлагаем.
     """
+    if not FFMPEG:
+        formats = [f for f in formats if not _oversize(f)]
+    merged = [f for f in formats if is_merged(f)]
+    audio = [f for f in formats if is_audio_only(f)]
+    video = [f for f in formats if not is_audio_only(f) and not is_merged(f)]
+    # чтобы клавиатура не была бесконечной; «лучшее» и аудио всегда оставляем
+    shown = merged + video[:15 - len(audio) - len(merged)] + audio
+    token = token_store.put(
+        url,
+        [f.format_id for f in shown],
+        audio=[f.format_id for f in audio],
+    )
+
     rows = []
-    for f in formats[:15]:  # чтобы клавиатура не была бесконечной
-        fmt_id = f.get("format_id")
-        ext = f.get("ext", "?")
-        res = f.get("resolution") or f.get("height") or ""
-        abr = f.get("abr")
-        size = f.get("filesize") or f.get("filesize_approx") or 0
-
-        if res:
+    for f in shown:
+        fmt_id = f.format_id
+        ext = f.ext or "?"
+        res = f.resolution or f.height or ""
+        abr = f.abr
+        size = f.size
+
+        if is_merged(f):
+            ext = f"⭐ Лучшее до {UPLOAD_MAX_MB} МБ:"
+            quality = f"{f.height}p" if f.height else "video"
+        elif is_audio_only(f):
+            ext = f"🎵 {audio_target(f) or ext}"
+            quality = f"{round(abr)}k" if abr else "audio"
+        elif res:
             quality = f"{res}"
         elif abr:
             quality = f"{abr}k audio"
@@ -48,10 +105,8 @@ def _build_formats_keyboard(formats, url: str) -> InlineKeyboardMarkup:
         size_str = human_bytes(size) if size else "?"
 
         text = f"{ext} {quality} ({size_str})"
-
-        # генерим короткий токен и сохраняем соответствие
-        token = uuid4().hex[:8]  # 8 символов — норм
-        DOWNLOAD_CACHE[token] = url
+        if _oversize(f):
+            text += " ✂️"
 
         cb = f"yt|{token}|{fmt_id}"
         rows.append([InlineKeyboardButton(text=text, callback_data=cb)])
@@ -59,10 +114,35 @@ def _build_formats_keyboard(formats, url: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+async def _offer_formats(bot, user_id: int, video_id: str) -> bool:
+    """Одна ссылка: своё сообщение «ищу…», которое становится клавиатурой."""
+    url = canonical_url(video_id)
+    status = StatusMessage(bot, user_id)
+    await status.show("Ищу данные о видео... 🔎")
+
+    try:
+        title, thumb, fmts = await prepare_formats(url)
+    except Exception as e:
+        errors.inc(stage="extract", error=type(e).__name__)
+        log.warning("extract failed", stage="extract", url=url, error=repr(e))
+        await status.show("Не удалось получить информацию о видео 😥")
+        return False
+
+    if not fmts:
+        await status.show("Не нашёл подходящих форматов для скачивания.")
+        return False
+
+    kb = _build_formats_keyboard(fmts, url)
+    text_resp = f"Выбери формат для:\n{title}" if thumb else f"Выбери формат:\n{title}"
+
+    await status.show(text_resp, reply_markup=kb)
+    return True
+
+
 @router.message()
 async def handle_youtube_link(message: Message):
     """
-    Ловим все сообщения, а внутри сами фильтруем по доменам youtube.com / youtu.be.
+    Ловим все сообщения, а внутри сами ищем ссылки на ролики YouTube.
     Никаких .reply и .recipient — только bot.send_message(user_id=...).
     """
     bot = get_current_dispatcher().bot
@@ -72,16 +152,18 @@ async def handle_youtube_link(message: Message):
         # команды и пустые сообщения игнорируем
         return
 
-    # проверяем, что это похоже на YouTube-ссылку
-    if not any(domain in text for domain in YOUTUBE_DOMAINS):
+    # все ролики из сообщения; до пулов yt-dlp доходят только они
+    video_ids = extract_video_ids(text, limit=MAX_LINKS_PER_MESSAGE)
+    if not video_ids:
         return
 
     # в umaxbot/README используют message.sender.id
     user_id = message.sender.id
-    url = text
+    bind(user=user_id)
 
-    # 1. Проверяем лимит
-    wait = check_limit(user_id)
+    # 1. Проверяем и сразу ставим лимит — до извлечения, иначе второе
+    # сообщение проскочит, пока первое ещё извлекается
+    wait = acquire_limit(user_id)
     if wait is not None:
         await bot.send_message(
             user_id=user_id,
@@ -89,39 +171,23 @@ async def handle_youtube_link(message: Message):
         )
         return
 
-    # 2. Пишем, что начали
-    await bot.send_message(
-        user_id=user_id,
-        text="Ищу данные о видео... 🔎",
-    )
-
+    # 2. Несколько ссылок — извлекаем форматы одновременно,
+    # каждому ролику своя клавиатура; ошибка одного ролика не мешает
+    # остальным и считается как «не предложили»
+    offered = False
     try:
-        title, thumb, fmts = await prepare_formats(url)
-    except Exception:
-        await bot.send_message(
-            user_id=user_id,
-            text="Не удалось получить информацию о видео 😥",
-        )
-        return
-
-    if not fmts:
-        await bot.send_message(
-            user_id=user_id,
-            text="Не нашёл подходящих форматов для скачивания.",
+        results = await asyncio.gather(
+            *(_offer_formats(bot, user_id, video_id) for video_id in video_ids),
+            return_exceptions=True,
         )
-        return
-
-    # 3. Ставим лимит
-    set_limit(user_id)
-
-    kb = _build_formats_keyboard(fmts, url)
-    text_resp = f"Выбери формат для:\n{title}" if thumb else f"Выбери формат:\n{title}"
-
-    await bot.send_message(
-        user_id=user_id,
-        text=text_resp,
-        reply_markup=kb,
-    )
+        for video_id, result in zip(video_ids, results):
+            if isinstance(result, BaseException):
+                log.warning("offer failed", stage="offer", video=video_id, error=repr(result))
+        offered = any(result is True for result in results)
+    finally:
+        # 3. Ничего не предложили (или нас отменили) — лимит снимаем
+        if not offered:
+            release_limit(user_id)
 
 
 @router.callback(TextStartsFilter("yt|"))
@@ -149,42 +215,251 @@ async def handle_youtube_download(callback: Callback):
         )
         return
 
-    # достаём url из кэша
-    url = DOWNLOAD_CACHE.get(token)
-    if not url:
+    # достаём url и проверяем, что такой формат предлагали
+    entry = token_store.get(token)
+    if entry is None or fmt_id not in entry.formats:
         await bot.send_message(
             user_id=user_id,
             text="Не удалось найти данные для этой кнопки, отправь ссылку ещё раз 🙏",
         )
         return
-
-    await bot.send_message(
+    url = entry.url
+    job = JobRecord(
+        job_id=uuid4().hex,
         user_id=user_id,
-        text="Скачиваю файл, подожди... ⏬",
+        url=url,
+        video_id=extract_video_id(url) or "",
+        format_id=fmt_id,
+        audio=fmt_id in entry.audio,
     )
 
+    # одно сообщение на всю задачу: очередь, прогресс, итог
+    status = StatusMessage(bot, user_id)
+    await status.show("Скачиваю файл, подожди... ⏬")
+    job.status_mid = status.mid or ""
+    journal.add(job)
+
+    await run_job(bot, job, status)
+
+
+async def run_job(bot, job: JobRecord, status: StatusMessage) -> None:
+    """
+    Задача от нажатия кнопки до файла у пользователя. Запись в журнале
+    снимается, чем бы задача ни кончилась, — кроме остановки бота
+    (отмены): такую задачу продолжит recover_jobs() при следующем старте.
+    """
     try:
-        file_path: Path = await download_selected_format(url, fmt_id, user_id)
+        await _run_job(bot, job, status)
     except Exception:
-        await bot.send_message(
-            user_id=user_id,
-            text="Ошибка при скачивании видео 😢",
+        journal.finish(job.job_id)
+        raise
+    # CancelledError (остановка) проходит мимо: запись остаётся в журнале
+    journal.finish(job.job_id)
+
+
+async def _run_job(bot, job: JobRecord, status: StatusMessage) -> None:
+    user_id = job.user_id
+    url = job.url
+    fmt_id = job.format_id
+    audio = job.audio
+    job_format.set(fmt_id)
+    # все записи этой задачи (и её фоновых отправок) — с этими полями
+    bind(job=job.job_id[:8], user=user_id, format=fmt_id)
+    started = time.monotonic()
+    log.info("job started", url=url, audio=audio, attempt=job.attempts)
+    upload_progress.set(status.upload_hook)
+
+    # если удалось понять id ролика — идём через кэш файлов,
+    # иначе качаем в отдельный каталог задачи в спуле
+    video_id = job.video_id or None
+
+    async def notify_queued(position: int) -> None:
+        await status.show(f"Много загрузок, ты в очереди: {position}-й ⏳")
+
+    # ожидаемый размер — для допуска по свободному месту и нарезки
+    found = find_cached_format(video_id, fmt_id) if video_id else None
+    expected_size = found[1].size or None if found else None
+    max_bytes = UPLOAD_MAX_MB * MB
+    oversize = bool(found and _oversize(found[1]))
+    if oversize and not FFMPEG:
+        # резать на части нечем — не качаем зря
+        await status.show(
+            f"Файл больше {human_bytes(max_bytes)}, MAX такой не примет — выбери формат поменьше 🙏"
         )
-        DOWNLOAD_CACHE.pop(token, None)
         return
 
-    try:
-        # отправляем как универсальный файл
-        await bot.send_file(
-            file_path=str(file_path),
-            media_type="file",
-            user_id=user_id,
-            text=f"Готово ✅\n{file_path.name}",
-        )
-    finally:
-        # чистим файл и токен
+    # потоковый режим: качаем и сразу грузим в MAX, без файла на диске
+    if PIPELINE_UPLOADS and video_id and not oversize and not media_cache.contains(video_id, fmt_id):
+        if found and can_pipeline(found[1]):
+            filename, fmt = found
+            resp = await send_pipelined(
+                bot,
+                url,
+                fmt,
+                filename=filename,
+                cache_key=f"{video_id}:{fmt_id}",
+                user_id=user_id,
+                text=filename,
+                slot=lambda: scheduler.download_slot(user_id, notify_queued),
+            )
+            if resp is not None and resp.status_code < 400:
+                await status.show("Готово ✅")
+                log.info(
+                    "job done", stage="total", pipelined=True,
+                    seconds=round(time.monotonic() - started, 3),
+                )
+                return
+            if resp is not None:
+                # MAX не принял сообщение — пробуем обычным путём
+                log.warning("pipelined file rejected", stage="attach", status=resp.status_code)
+
+    async def fetch(staging: Path) -> Path:
+        journal.update(job.job_id, state="downloading", staging=str(staging))
+        async with spool.reserve(expected_size):
+            return await download_to_dir(
+                url, fmt_id, staging, user_id, notify_queued, audio=audio,
+                on_progress=status.download_hook(),
+            )
+
+    async with AsyncExitStack() as stack:
         try:
-            file_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-        DOWNLOAD_CACHE.pop(token, None)
+            if video_id:
+                # каталог по id задачи: после рестарта yt-dlp продолжит .part в нём
+                file_path: Path = await media_cache.acquire(
+                    video_id, fmt_id, fetch, staging_name=job.job_id
+                )
+                # отпускаем файл в кэше после отправки
+                stack.callback(media_cache.release, video_id, fmt_id)
+            else:
+                # свой каталог задачи, удаляется после отправки
+                job_dir = await stack.enter_async_context(spool.job(expected_size))
+                file_path = await download_to_dir(
+                    url, fmt_id, job_dir, user_id, notify_queued, audio=audio,
+                    on_progress=status.download_hook(),
+                )
+        except QueueFull:
+            errors.inc(stage="queue", error="QueueFull")
+            log.warning("queue full", stage="queue")
+            await status.show("Сейчас слишком много загрузок, попробуй через пару минут 🙏")
+            return
+        except SpoolFull as e:
+            errors.inc(stage="spool", error="SpoolFull")
+            log.warning("no disk space", stage="spool", error=str(e))
+            await status.show("Сейчас на сервере не хватает места, попробуй чуть позже 🙏")
+            return
+        except Exception as e:
+            errors.inc(stage="download", error=type(e).__name__)
+            log.warning("download failed", stage="download", error=repr(e))
+            await status.show("Ошибка при скачивании видео 😢")
+            return
+
+        # видео — как универсальный файл, звук — как аудио
+        media_type = "audio" if audio else "file"
+        cache_key = f"{video_id}:{fmt_id}" if video_id else None
+        journal.update(job.job_id, state="uploading")
+
+        size = file_path.stat().st_size
+        if size > max_bytes:
+            # больше потолка MAX: режем по времени без перекодирования
+            # и шлём серией сообщений
+            await status.show("Файл большой, режу на части... ✂️")
+            try:
+                parts_dir = await stack.enter_async_context(spool.job(size, prefix="split_"))
+            except SpoolFull as e:
+                errors.inc(stage="spool", error="SpoolFull")
+                log.warning("no disk space for parts", stage="split", error=str(e))
+                await status.show("Сейчас на сервере не хватает места, попробуй чуть позже 🙏")
+                return
+            duration = found[1].duration if found else None
+            try:
+                parts = await asyncio.to_thread(
+                    split_for_upload, file_path, parts_dir, max_bytes, duration
+                )
+            except Exception as e:
+                errors.inc(stage="split", error=type(e).__name__)
+                log.warning("split failed", stage="split", size=size, error=repr(e))
+                await status.show(
+                    f"Файл больше {human_bytes(max_bytes)}, и разрезать его не вышло 😢"
+                )
+                return
+            log.info("split", stage="split", size=size, parts=len(parts))
+
+        # «Готово» — только если MAX принял сообщение с файлом: статус
+        # больше не подпись самого файла и сам по себе ничего не доказывает
+        try:
+            if size > max_bytes:
+                resps = await bot.send_parts(
+                    [str(p) for p in parts],
+                    media_type,
+                    user_id=user_id,
+                    text=file_path.name,
+                    cache_key=cache_key,
+                )
+                resp = resps[-1]
+            else:
+                resp = await bot.send_file(
+                    file_path=str(file_path),
+                    media_type=media_type,
+                    user_id=user_id,
+                    text=file_path.name,
+                    cache_key=cache_key,
+                )
+        except PartRejected as e:
+            # HTTP-ошибка части уже посчитана в mybot (stage=attach)
+            log.warning("part rejected", stage="attach", part=e.part, status=e.status)
+            await status.show(f"MAX не принял часть {e.part} 😢 Попробуй ещё раз")
+            return
+        except Exception as e:
+            # ошибки загрузки уже посчитаны в mybot (stage=upload)
+            log.warning("send failed", stage="upload", error=repr(e))
+            await status.show("Не удалось отправить файл в MAX 😢 Попробуй ещё раз")
+            return
+        if resp.status_code >= 400:
+            log.warning("file rejected", stage="attach", status=resp.status_code)
+            await status.show("MAX не принял файл 😢 Попробуй ещё раз")
+            return
+    await status.show("Готово ✅")
+    log.info("job done", stage="total", seconds=round(time.monotonic() - started, 3))
+
+
+# задачи, поднятые после рестарта, — держим ссылки до завершения
+_recovered: set = set()
+
+
+async def recover_jobs(bot) -> int:
+    """
+    Продолжает задачи, прерванные прошлой остановкой бота: докачивает
+    (yt-dlp подхватит .part в том же каталоге) и отправляет файл, правя
+    прежнее сообщение о ходе задачи. Возвращает, сколько задач поднято.
+    """
+    now = time.time()
+    resumed = 0
+    dropped = journal.drop_abandoned(now - JOURNAL_MAX_AGE_HOURS * 3600)
+    if dropped:
+        log.warning("abandoned jobs of other instances dropped", jobs=dropped)
+    for job in journal.pending():
+        status = StatusMessage(bot, job.user_id, mid=job.status_mid or None)
+        too_old = now - job.created > JOURNAL_MAX_AGE_HOURS * 3600
+        if job.attempts >= JOURNAL_MAX_ATTEMPTS or too_old:
+            journal.finish(job.job_id)
+            if job.staging:
+                shutil.rmtree(job.staging, ignore_errors=True)
+            log.warning("job dropped", job=job.job_id[:8], attempts=job.attempts, too_old=too_old)
+            await status.show("Не удалось докачать файл после перезапуска, отправь ссылку ещё раз 🙏")
+            continue
+
+        job.attempts += 1
+        journal.update(job.job_id, attempts=job.attempts)
+        task = asyncio.create_task(_resume(bot, job, status))
+        _recovered.add(task)
+        task.add_done_callback(_recovered.discard)
+        resumed += 1
+    return resumed
+
+
+async def _resume(bot, job: JobRecord, status: StatusMessage) -> None:
+    try:
+        await status.show("Бот перезапускался, продолжаю загрузку... ⏬")
+        await run_job(bot, job, status)
+    except Exception:
+        log.exception("resumed job failed", job=job.job_id[:8])
@@ -0,0 +1,109 @@
+# httpserver.py
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple
+
+from logs import get_logger
+
+log = get_logger("http")
+
+# (method, path, query, headers, body) -> (status, content_type, body)
+Handler = Callable[[str, str, str, Dict[str, str], bytes], Awaitable[Tuple[int, str, bytes]]]
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def _response(status: int, content_type: str, body: bytes, keep_alive: bool) -> bytes:
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def _serve_connection(
+    handler: Handler,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    max_body: int,
+) -> None:
+    try:
+        while True:
+            try:
+                raw = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+
+            lines = raw.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                writer.write(_response(400, "text/plain", b"bad request", False))
+                return
+
+            headers: Dict[str, str] = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                writer.write(_response(400, "text/plain", b"bad content-length", False))
+                return
+            if length > max_body:
+                writer.write(_response(413, "text/plain", b"too large", False))
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            keep_alive = (
+                version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            )
+            path, _, query = target.partition("?")
+            try:
+                status, content_type, resp_body = await handler(method, path, query, headers, body)
+            except Exception:
+                log.exception("handler failed", method=method, path=path)
+                writer.write(_response(500, "text/plain", b"internal error", False))
+                await writer.drain()
+                return
+            writer.write(_response(status, content_type, resp_body, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(
+    handler: Handler,
+    host: str,
+    port: int,
+    max_body: int = MAX_BODY_BYTES,
+) -> asyncio.AbstractServer:
+    """
+    Минимальный HTTP/1.1-сервер на asyncio для служебных эндпоинтов бота
+    (webhook, метрики): только Content-Length, без chunked-запросов.
+    """
+    return await asyncio.start_server(
+        lambda r, w: _serve_connection(handler, r, w, max_body),
+        host,
+        port,
+        limit=MAX_HEADER_BYTES,
+    )
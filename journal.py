@@ -0,0 +1,167 @@
+# journal.py
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Set
+
+import db
+from config import INSTANCE_ID, JOURNAL_BACKEND, JOURNAL_DB
+
+
+@dataclass
+class JobRecord:
+    """Одна задача скачивания: хватит, чтобы продолжить её после рестарта."""
+
+    job_id: str
+    user_id: int
+    url: str
+    video_id: str
+    format_id: str
+    audio: bool = False
+    # queued -> downloading -> uploading; готовые задачи из журнала удаляются
+    state: str = "queued"
+    # каталог, куда yt-dlp пишет файл и его .part
+    staging: str = ""
+    # сообщение о ходе задачи — после рестарта правим его же
+    status_mid: str = ""
+    attempts: int = 0
+    created: float = 0.0
+    # процесс бота, который ведёт задачу (INSTANCE_ID)
+    owner: str = ""
+
+
+class MemoryJournal:
+    """Журнал в памяти процесса: рестарт не переживает (тесты, нагрузочный прогон)."""
+
+    def __init__(self, owner: str = "") -> None:
+        self.owner = owner
+        self._jobs: Dict[str, JobRecord] = {}
+
+    def add(self, job: JobRecord) -> None:
+        self._jobs[job.job_id] = replace(job, created=job.created or time.time(), owner=self.owner)
+
+    def update(self, job_id: str, **fields) -> None:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._jobs[job_id] = replace(job, **fields)
+
+    def finish(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+    def pending(self) -> List[JobRecord]:
+        return sorted(self._jobs.values(), key=lambda j: j.created)
+
+    def drop_abandoned(self, before: float) -> int:
+        # чужих задач в памяти процесса не бывает
+        return 0
+
+    def stagings(self) -> Set[str]:
+        return {job.staging for job in self._jobs.values() if job.staging}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+class SqliteJournal:
+    """
+    Журнал задач в SQLite: всё, что не дошло до пользователя к моменту
+    остановки, остаётся в таблице и поднимается при следующем старте.
+    Файл может быть общим для нескольких процессов (общий DATA_DIR):
+    каждая задача помечена owner, и pending() отдаёт только свои —
+    рестарт одного процесса не перезапускает живые задачи соседей.
+    """
+
+    COLUMNS = (
+        "job_id", "user_id", "url", "video_id", "format_id", "audio",
+        "state", "staging", "status_mid", "attempts", "created", "owner",
+    )
+
+    def __init__(self, path: Path, owner: str):
+        self.owner = owner
+        self._conn = db.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " user_id INTEGER NOT NULL,"
+            " url TEXT NOT NULL,"
+            " video_id TEXT NOT NULL DEFAULT '',"
+            " format_id TEXT NOT NULL,"
+            " audio INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT NOT NULL,"
+            " staging TEXT NOT NULL DEFAULT '',"
+            " status_mid TEXT NOT NULL DEFAULT '',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL,"
+            " owner TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # база от версии с одним процессом на DATA_DIR
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+
+    def add(self, job: JobRecord) -> None:
+        job = replace(job, created=job.created or time.time(), owner=self.owner)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO jobs ({', '.join(self.COLUMNS)})"
+            f" VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            tuple(int(v) if isinstance(v, bool) else v for v in (getattr(job, c) for c in self.COLUMNS)),
+        )
+
+    def update(self, job_id: str, **fields) -> None:
+        unknown = set(fields) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown journal fields: {unknown}")
+        self._conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
+
+    def finish(self, job_id: str) -> None:
+        self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def pending(self) -> List[JobRecord]:
+        # задачи без owner (от версии до общего DATA_DIR) одним UPDATE
+        # забирает первый поднявшийся процесс
+        self._conn.execute("UPDATE jobs SET owner = ? WHERE owner = ''", (self.owner,))
+        rows = self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE owner = ? ORDER BY created",
+            (self.owner,),
+        ).fetchall()
+        jobs = []
+        for row in rows:
+            job = JobRecord(*row)
+            job.audio = bool(job.audio)
+            jobs.append(job)
+        return jobs
+
+    def drop_abandoned(self, before: float) -> int:
+        """
+        Удаляет чужие задачи, созданные раньше before: их владелец больше
+        не поднимался (например, у контейнера сменилось имя хоста).
+        """
+        cur = self._conn.execute(
+            "DELETE FROM jobs WHERE owner != ? AND created < ?", (self.owner, before)
+        )
+        return cur.rowcount
+
+    def stagings(self) -> Set[str]:
+        """
+        Каталоги .tmp всех незавершённых задач (и соседей тоже): уборщик
+        их не трогает, в них задача докачает файл после рестарта.
+        """
+        rows = self._conn.execute("SELECT staging FROM jobs WHERE staging != ''")
+        return {staging for (staging,) in rows}
+
+    def __len__(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE owner = ?", (self.owner,)
+        ).fetchone()
+        return count
+
+
+if JOURNAL_BACKEND == "sqlite":
+    journal = SqliteJournal(JOURNAL_DB, INSTANCE_ID)
+elif JOURNAL_BACKEND == "memory":
+    journal = MemoryJournal(INSTANCE_ID)
+else:
+    raise RuntimeError(f"Неизвестный JOURNAL_BACKEND: {JOURNAL_BACKEND}")
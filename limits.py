@@ -1,10 +1,135 @@
-from datetime import datetime, timedelta
-from typing import Dict
+import time
+from collections import OrderedDict
+from pathlib import Path
 
-from config import YOUTUBE_NEXT_FETCH_MINUTES
+import db
+from config import LIMITS_BACKEND, LIMITS_DB, YOUTUBE_NEXT_FETCH_MINUTES
 
-# user_id -> datetime, когда можно снова качать
-_user_next_time: Dict[int, datetime] = {}
+# чистим sqlite от истёкших записей не чаще, чем раз в столько секунд
+SWEEP_INTERVAL = 60
+
+
+def _minutes_left(next_time: float, now: float) -> float | None:
+    if next_time > now:
+        return round((next_time - now) / 60, 2)
+    return None
+
+
+class MemoryLimiter:
+    """
+    Лимит в памяти процесса.
+    Кулдаун у всех одинаковый, поэтому порядок вставки = порядок истечения:
+    истёкшие записи снимаются с начала OrderedDict за O(1) на запись,
+    и в памяти живут только пользователи с активным кулдауном.
+    """
+
+    def __init__(self, cooldown: float):
+        self.cooldown = cooldown
+        # user_id -> time.monotonic(), когда можно снова качать
+        self._next: "OrderedDict[int, float]" = OrderedDict()
+
+    def _sweep(self, now: float) -> None:
+        while self._next:
+            user_id, next_time = next(iter(self._next.items()))
+            if next_time > now:
+                break
+            del self._next[user_id]
+
+    def check_limit(self, user_id: int) -> float | None:
+        now = time.monotonic()
+        self._sweep(now)
+        next_time = self._next.get(user_id)
+        return _minutes_left(next_time, now) if next_time else None
+
+    def set_limit(self, user_id: int) -> None:
+        now = time.monotonic()
+        self._sweep(now)
+        self._next[user_id] = now + self.cooldown
+        self._next.move_to_end(user_id)
+
+    def acquire(self, user_id: int) -> float | None:
+        # между проверкой и записью нет await — для одного процесса атомарно
+        wait = self.check_limit(user_id)
+        if wait is None:
+            self.set_limit(user_id)
+        return wait
+
+    def release(self, user_id: int) -> None:
+        self._next.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._next)
+
+
+class SqliteLimiter:
+    """
+    Лимит в SQLite-файле: переживает рестарт и общий для нескольких
+    процессов бота с одним токеном. Проверка — один запрос по первичному
+    ключу, истёкшие записи периодически удаляются по индексу.
+    """
+
+    def __init__(self, path: Path, cooldown: float):
+        self.cooldown = cooldown
+        self._conn = db.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS limits ("
+            " user_id INTEGER PRIMARY KEY,"
+            " next_time REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS limits_next_time ON limits(next_time)"
+        )
+        self._last_sweep = 0.0
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self._conn.execute("DELETE FROM limits WHERE next_time <= ?", (now,))
+
+    def check_limit(self, user_id: int) -> float | None:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT next_time FROM limits WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return _minutes_left(row[0], now) if row else None
+
+    def set_limit(self, user_id: int) -> None:
+        now = time.time()
+        self._sweep(now)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO limits (user_id, next_time) VALUES (?, ?)",
+            (user_id, now + self.cooldown),
+        )
+
+    def acquire(self, user_id: int) -> float | None:
+        """
+        Проверка и запись одним запросом: из двух процессов, одновременно
+        пришедших за одним пользователем, кулдаун получит только один.
+        """
+        now = time.time()
+        self._sweep(now)
+        cur = self._conn.execute(
+            "INSERT INTO limits (user_id, next_time) VALUES (?, ?)"
+            " ON CONFLICT(user_id) DO UPDATE SET next_time = excluded.next_time"
+            " WHERE limits.next_time <= ?",
+            (user_id, now + self.cooldown, now),
+        )
+        if cur.rowcount:
+            return None
+        # кулдаун уже стоит — нужен только остаток для ответа
+        return self.check_limit(user_id) or round(self.cooldown / 60, 2)
+
+    def release(self, user_id: int) -> None:
+        self._conn.execute("DELETE FROM limits WHERE user_id = ?", (user_id,))
+
+
+if LIMITS_BACKEND == "sqlite":
+    limiter = SqliteLimiter(LIMITS_DB, YOUTUBE_NEXT_FETCH_MINUTES * 60)
+elif LIMITS_BACKEND == "memory":
+    limiter = MemoryLimiter(YOUTUBE_NEXT_FETCH_MINUTES * 60)
+else:
+    raise RuntimeError(f"Неизвестный LIMITS_BACKEND: {LIMITS_BACKEND}")
 
 
 def check_limit(user_id: int) -> float | None:
@@ -13,14 +138,21 @@ def check_limit(user_id: int) -> float | None:
     Возвращает None, если можно.
     Возвращает кол-во минут ожидания (float), если нельзя.
     """
-    now = datetime.utcnow()
-    next_time = _user_next_time.get(user_id)
-    if next_time and next_time > now:
-        delta = next_time - now
-        return round(delta.total_seconds() / 60, 2)
-    return None
+    return limiter.check_limit(user_id)
 
 
 def set_limit(user_id: int) -> None:
-    now = datetime.utcnow()
-    _user_next_time[user_id] = now + timedelta(minutes=YOUTUBE_NEXT_FETCH_MINUTES)
+    limiter.set_limit(user_id)
+
+
+def acquire_limit(user_id: int) -> float | None:
+    """
+    check_limit + set_limit атомарно: None — можно качать, и кулдаун
+    уже поставлен; иначе кол-во минут ожидания.
+    """
+    return limiter.acquire(user_id)
+
+
+def release_limit(user_id: int) -> None:
+    """Снимает кулдаун, поставленный acquire_limit (ничего не предложили)."""
+    limiter.release(user_id)
@@ -0,0 +1,60 @@
+# links.py
+import re
+from typing import List, Optional
+
+# id ролика YouTube — всегда 11 символов [A-Za-z0-9_-]
+_VIDEO_ID_RE = re.compile(
+    r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])"
+)
+
+# ссылка на ролик в произвольном тексте: youtube.com (www., m., music.)
+# /watch?...v=, /shorts/, /embed/, /live/, /v/, youtube-nocookie.com/embed/
+# и youtu.be/. Каналы, плейлисты и поиск сюда не попадают.
+_LINK_RE = re.compile(
+    r"(?<![\w.-])(?:https?://)?(?:(?:www|m|music)\.)?"
+    r"(?:"
+    r"youtube\.com/(?:watch/?\?(?:[^\s#]*?&)?v=|shorts/|embed/|live/|v/)"
+    r"|youtube-nocookie\.com/embed/"
+    r"|youtu\.be/"
+    r")"
+    r"([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])",
+    re.IGNORECASE,
+)
+
+# грубая проверка «вообще про YouTube» — без копий текста (lower())
+_HINT_RE = re.compile("youtu", re.IGNORECASE)
+
+
+def canonical_url(video_id: str) -> str:
+    """Единый вид ссылки: по нему совпадают ключи кэшей и токены клавиатур."""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def mentions_youtube(text: str) -> bool:
+    return _HINT_RE.search(text) is not None
+
+
+def extract_video_ids(text: str, limit: Optional[int] = None) -> List[str]:
+    """
+    Все id роликов из текста сообщения по порядку, без повторов;
+    limit — не больше стольких. Текст без «youtu» не разбирается вовсе.
+    """
+    if not mentions_youtube(text):
+        return []
+    ids: List[str] = []
+    for m in _LINK_RE.finditer(text):
+        video_id = m.group(1)
+        if video_id not in ids:
+            ids.append(video_id)
+            if limit and len(ids) >= limit:
+                break
+    return ids
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """
+    Достаёт канонический id ролика из ссылки на YouTube.
+    Возвращает None, если id найти не удалось.
+    """
+    m = _VIDEO_ID_RE.search(url)
+    return m.group(1) if m else None
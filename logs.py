@@ -0,0 +1,179 @@
+# logs.py
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from config import BOT_TOKEN, LOG_FIELD_MAX, LOG_FORMAT, LOG_LEVEL
+
+# поля задачи (job, user, format...) — проставляются один раз в хендлере
+# и попадают во все записи этой задачи и её дочерних asyncio-задач
+_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# ключи, значения которых никогда не пишем
+SECRET_KEYS = {"access_token", "authorization", "token", "secret"}
+_SECRET_RE = re.compile(
+    r"""((?:access_token|authorization|secret)['"]?\s*[:=]\s*['"]?)[^'"&\s,}]+""",
+    re.IGNORECASE,
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind(**fields: Any) -> None:
+    """Добавляет поля в контекст текущей задачи."""
+    _context.set({**_context.get(), **fields})
+
+
+def redact(text: str) -> str:
+    if BOT_TOKEN and BOT_TOKEN in text:
+        text = text.replace(BOT_TOKEN, "***")
+    return _SECRET_RE.sub(r"\1***", text)
+
+
+def truncate(text: str, limit: int = LOG_FIELD_MAX) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}…(+{len(text) - limit})"
+    return text
+
+
+def _clean(key: str, value: Any) -> Any:
+    if key.lower() in SECRET_KEYS:
+        return "***"
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return truncate(redact(str(value)))
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Одна строка на запись: текст (key=value) или JSON.
+    Работает в потоке QueueListener — event loop на это время не тратит.
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {k: _clean(k, v) for k, v in getattr(record, "fields", {}).items()}
+        message = truncate(redact(record.getMessage()))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        exc = redact(record.exc_text) if record.exc_text else ""
+
+        if self.fmt == "json":
+            data = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": message,
+                **fields,
+            }
+            if exc:
+                data["exc"] = exc
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        line = f"{ts}.{int(record.msecs):03d} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if exc:
+            line += "\n" + exc
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # очередь в памяти процесса: запись отдаём как есть, всё
+        # форматирование (включая traceback) — в потоке вывода
+        return record
+
+
+class _ContextFilter(logging.Filter):
+    """Прикрепляет поля контекста в потоке, где сделана запись."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _context.get()
+        if ctx:
+            record.fields = {**ctx, **getattr(record, "fields", {})}
+        return True
+
+
+class Logger:
+    """
+    Тонкая обёртка над logging: log.info("upload done", size=..., seconds=...).
+    sample=0.1 — писать только ~10% записей (для событий на каждую попытку).
+    """
+
+    def __init__(self, name: str):
+        self._log = logging.getLogger(name)
+
+    def _emit(self, level: int, msg: str, sample: float, exc_info: bool, fields: Dict[str, Any]) -> None:
+        if not self._log.isEnabledFor(level):
+            return
+        if sample < 1.0 and random.random() >= sample:
+            return
+        self._log.log(level, msg, extra={"fields": fields}, exc_info=exc_info, stacklevel=3)
+
+    def debug(self, msg: str, *, sample: float = 1.0, **fields: Any) -> None:
+        self._emit(logging.DEBUG, msg, sample, False, fields)
+
+    def info(self, msg: str, *, sample: float = 1.0, **fields: Any) -> None:
+        self._emit(logging.INFO, msg, sample, False, fields)
+
+    def warning(self, msg: str, *, sample: float = 1.0, **fields: Any) -> None:
+        self._emit(logging.WARNING, msg, sample, False, fields)
+
+    def error(self, msg: str, *, exc_info: bool = False, **fields: Any) -> None:
+        self._emit(logging.ERROR, msg, 1.0, exc_info, fields)
+
+    def exception(self, msg: str, **fields: Any) -> None:
+        self._emit(logging.ERROR, msg, 1.0, True, fields)
+
+
+def get_logger(name: str) -> Logger:
+    return Logger(name)
+
+
+def setup() -> None:
+    """
+    Корневой логгер пишет в очередь (дёшево, без I/O), а в stdout
+    пишет отдельный поток QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    # болтливые библиотеки — только предупреждения
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Дописывает хвост очереди и останавливает поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,16 +1,34 @@
 # main.py
 
 import asyncio
-from mybot import Bot
-from maxbot.dispatcher import Dispatcher
-from callbacks import router as callbacks_router
-from config import BOT_TOKEN
-from handlers.start import router as start_router
-from handlers.help import router as help_router
-from handlers.youtube import router as youtube_router
 
 
 async def main():
+    # бот импортируется здесь, а не на уровне модуля: воркеры извлечения
+    # (spawn) заново импортируют __main__, и им незачем открывать базы,
+    # сканировать кэш файлов и заводить очереди бота ради одного yt-dlp
+    import logs
+    from mybot import Bot
+    from maxbot.dispatcher import Dispatcher
+    from callbacks import router as callbacks_router
+    import metrics
+    from attachment_cache import attachment_cache
+    from config import BOT_TOKEN, UPDATES_MODE, WATCHDOG_ENABLED
+    from extract_pool import process_extractor
+    from handlers.start import router as start_router
+    from handlers.help import router as help_router
+    from handlers.youtube import recover_jobs, router as youtube_router
+    from media_cache import media_cache
+    from meta_cache import meta_cache
+    from scheduler import scheduler
+    from spool import spool
+    from watchdog import watchdog
+    from webhook import run_webhook
+
+    # логи пишет отдельный поток, event loop только кладёт записи в очередь
+    logs.setup()
+    log = logs.get_logger("main")
+
     # создаём бота
     bot = Bot(token=BOT_TOKEN)
 
@@ -23,10 +41,45 @@ async def main():
     dp.include_router(youtube_router)
     dp.include_router(callbacks_router)
 
-    print("🤖 Бот запущен...")
+    # метрики: кэши и очереди читаются в момент запроса /metrics
+    metrics.register_cache("media", media_cache.stats)
+    metrics.register_cache("meta", meta_cache.stats)
+    metrics.register_cache("attachment", attachment_cache.stats)
+    metrics.register_queue("download", scheduler.stats)
+    metrics.register_queue("updates", lambda: {"size": dp.queue.qsize()})
+    metrics.register_stats("ytbot_spool", "Место под загрузки", spool.stats)
+    metrics.register_queue("api", bot.governor.stats)
+    await metrics.start_metrics_server()
+
+    # сторож event loop: лаг и стеки долгих блокировок
+    if WATCHDOG_ENABLED:
+        await watchdog.start()
+
+    # прогреваем процессы извлечения (если включены)
+    await process_extractor.start()
+
+    # убираем брошенное прошлыми запусками и запускаем уборщика
+    await spool.start()
+
+    # продолжаем задачи, прерванные прошлой остановкой
+    resumed = await recover_jobs(bot)
+    if resumed:
+        log.info("resumed interrupted jobs", jobs=resumed)
+
+    log.info("🤖 Бот запущен...", mode=UPDATES_MODE)
 
-    # запуск polling
-    await dp.run_polling()
+    # приём апдейтов: long polling или webhook
+    try:
+        if UPDATES_MODE == "webhook":
+            await run_webhook(dp)
+        else:
+            await dp.run_polling()
+    finally:
+        spool.stop()
+        watchdog.stop()
+        process_extractor.shutdown()
+        await bot.close()
+        logs.shutdown()
 
 
 if __name__ == "__main__":
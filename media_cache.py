@@ -0,0 +1,283 @@
+# media_cache.py
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Collection, Dict, Optional, Set
+from uuid import uuid4
+
+from config import JOURNAL_MAX_AGE_HOURS, MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB, SPOOL_ORPHAN_HOURS
+from journal import journal
+
+# недокачанные каталоги старше этого возраста считаем брошенными; не раньше,
+# чем журнал перестаёт докачивать в них задачи после рестарта
+STALE_STAGING_SECONDS = max(JOURNAL_MAX_AGE_HOURS, SPOOL_ORPHAN_HOURS) * 3600
+
+
+@dataclass
+class _Entry:
+    file: Path
+    size: int
+    readers: int = 0
+
+
+class MediaCache:
+    """
+    Постоянный кэш скачанных файлов: (video_id, format_id) -> файл на диске.
+
+    Каждая запись — каталог <root>/<sha1(ключа)>/ с одним файлом внутри
+    (имя файла сохраняется, чтобы пользователь видел нормальное название).
+    Файл сначала качается в <root>/.tmp/<uuid>/, а потом публикуется
+    атомарным rename каталога — читатели никогда не видят недокачанный файл.
+    Пока файл кем-то читается (acquire без release), он не вытесняется.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.tmp_root = root / ".tmp"
+        self.max_bytes = max_bytes
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._fill_locks: Dict[str, asyncio.Lock] = {}
+        # сколько запросов держат или ждут замок ключа: убираем замок,
+        # только когда никого не осталось, иначе ждущие и новые запросы
+        # разойдутся по разным замкам и качнут один файл дважды
+        self._fill_waiters: Dict[str, int] = {}
+        # каталоги .tmp, в которые сейчас качает этот процесс
+        self._staging: Set[Path] = set()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    # ------------------------ ключи и индекс ------------------------ #
+    @staticmethod
+    def make_key(video_id: str, format_id: str) -> str:
+        return hashlib.sha1(f"{video_id}|{format_id}".encode()).hexdigest()
+
+    @staticmethod
+    def _entry_file(entry_dir: Path) -> Optional[Path]:
+        for p in entry_dir.iterdir():
+            if p.is_file():
+                return p
+        return None
+
+    def _load(self) -> None:
+        """Поднимаем индекс с диска, порядок LRU — по mtime файлов."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.tmp_root.mkdir(exist_ok=True)
+        self.sweep_staging(STALE_STAGING_SECONDS, journal.stagings())
+
+        found = []
+        for entry_dir in self.root.iterdir():
+            if entry_dir == self.tmp_root or not entry_dir.is_dir():
+                continue
+            file = self._entry_file(entry_dir)
+            if file is None:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            st = file.stat()
+            found.append((st.st_mtime, entry_dir.name, _Entry(file, st.st_size)))
+
+        found.sort(key=lambda x: x[0])
+        for _, key, entry in found:
+            self._entries[key] = entry
+            self.total_bytes += entry.size
+
+    def _adopt(self, key: str) -> Optional[_Entry]:
+        """Запись могла появиться на диске из другого процесса."""
+        entry_dir = self.root / key
+        if not entry_dir.is_dir():
+            return None
+        file = self._entry_file(entry_dir)
+        if file is None:
+            return None
+        entry = _Entry(file, file.stat().st_size)
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        return entry
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and not entry.file.exists():
+            # файл удалили снаружи (другой процесс / ручная чистка)
+            del self._entries[key]
+            self.total_bytes -= entry.size
+            entry = None
+        if entry is None:
+            entry = self._adopt(key)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        try:
+            # mtime = время последнего использования, переживает рестарт
+            os.utime(entry.file)
+        except OSError:
+            pass
+        return entry
+
+    # ------------------------ публичное API ------------------------ #
+    async def acquire(
+        self,
+        video_id: str,
+        format_id: str,
+        fetch: Callable[[Path], Awaitable[Path]],
+        staging_name: Optional[str] = None,
+    ) -> Path:
+        """
+        Возвращает путь к файлу из кэша. При промахе вызывает
+        fetch(staging_dir), который должен скачать файл в staging_dir
+        и вернуть путь к нему. После использования обязательно release().
+        staging_name — постоянное имя каталога .tmp (id задачи): при отмене
+        (остановка бота) он не удаляется, и задача докачает файл с того же
+        места после рестарта.
+        """
+        key = self.make_key(video_id, format_id)
+
+        entry = self._lookup(key)
+        if entry is None:
+            lock = self._fill_locks.setdefault(key, asyncio.Lock())
+            self._fill_waiters[key] = self._fill_waiters.get(key, 0) + 1
+            try:
+                async with lock:
+                    entry = self._lookup(key)
+                    if entry is None:
+                        self.misses += 1
+                        entry = await self._fill(key, fetch, staging_name)
+                    else:
+                        # пока ждали, файл скачал соседний запрос
+                        self.hits += 1
+            finally:
+                left = self._fill_waiters[key] - 1
+                if left:
+                    self._fill_waiters[key] = left
+                else:
+                    del self._fill_waiters[key]
+                    del self._fill_locks[key]
+        else:
+            self.hits += 1
+
+        entry.readers += 1
+        self._evict()
+        return entry.file
+
+    def contains(self, video_id: str, format_id: str) -> bool:
+        """Есть ли готовый файл (без учёта в статистике и LRU)."""
+        key = self.make_key(video_id, format_id)
+        return key in self._entries or (self.root / key).is_dir()
+
+    def release(self, video_id: str, format_id: str) -> None:
+        entry = self._entries.get(self.make_key(video_id, format_id))
+        if entry is not None and entry.readers > 0:
+            entry.readers -= 1
+        self._evict()
+
+    def trim(self, target_bytes: int) -> int:
+        """
+        Вытесняет незанятые записи (LRU), пока кэш не станет не больше
+        target_bytes. Возвращает, сколько байт освободили.
+        """
+        before = self.total_bytes
+        for key in list(self._entries):
+            if self.total_bytes <= target_bytes:
+                break
+            entry = self._entries[key]
+            if entry.readers:
+                continue
+            del self._entries[key]
+            self.total_bytes -= entry.size
+            shutil.rmtree(entry.file.parent, ignore_errors=True)
+            self.evictions += 1
+        return before - self.total_bytes
+
+    def sweep_staging(self, max_age: float, keep: Collection[str] = ()) -> int:
+        """
+        Удаляет недокачанные каталоги .tmp старше max_age секунд
+        (кроме тех, в которые качает этот процесс, и тех, что в keep, —
+        их ждут задачи журнала). Возвращает их число.
+        """
+        removed = 0
+        now = time.time()
+        for staging in self.tmp_root.iterdir():
+            if staging in self._staging or str(staging) in keep:
+                continue
+            try:
+                if now - staging.stat().st_mtime > max_age:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    # ------------------------ внутренности ------------------------ #
+    async def _fill(
+        self,
+        key: str,
+        fetch: Callable[[Path], Awaitable[Path]],
+        staging_name: Optional[str] = None,
+    ) -> _Entry:
+        staging = self.tmp_root / (staging_name or uuid4().hex)
+        staging.mkdir(parents=True, exist_ok=staging_name is not None)
+        self._staging.add(staging)
+        try:
+            file_path = await fetch(staging)
+
+            # в записи должен остаться только сам файл
+            for p in staging.iterdir():
+                if p != file_path:
+                    if p.is_dir():
+                        shutil.rmtree(p, ignore_errors=True)
+                    else:
+                        p.unlink(missing_ok=True)
+
+            entry_dir = self.root / key
+            try:
+                os.replace(staging, entry_dir)  # атомарная публикация
+            except OSError:
+                # другой процесс уже опубликовал ту же запись — берём её
+                shutil.rmtree(staging, ignore_errors=True)
+                entry = self._adopt(key)
+                if entry is None:
+                    raise
+                return entry
+        except asyncio.CancelledError:
+            # остановка: недокачанное в именованном каталоге ещё пригодится
+            if staging_name is None:
+                shutil.rmtree(staging, ignore_errors=True)
+            raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            self._staging.discard(staging)
+
+        file = entry_dir / file_path.name
+        entry = _Entry(file, file.stat().st_size)
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        return entry
+
+    def _evict(self) -> None:
+        if self.total_bytes > self.max_bytes:
+            self.trim(self.max_bytes)
+
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,95 @@
+# meta_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import META_CACHE_SIZE, META_CACHE_TTL_MINUTES
+
+
+class MetaCache:
+    """
+    TTL + LRU кэш метаданных роликов (video_id -> список форматов)
+    с объединением одновременных запросов: пока идёт извлечение для
+    video_id, все остальные запросы ждут тот же future, а не запускают
+    ещё одно извлечение.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Tuple[Any, Optional[float]]]],
+    ) -> Any:
+        """
+        loader() возвращает (value, ttl). ttl=None — обычный TTL кэша,
+        иначе берётся минимум (например, до истечения подписанных ссылок).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+
+        # shield: отмена одного ожидающего не должна отменять общую загрузку
+        return await asyncio.shield(task)
+
+    async def _load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Tuple[Any, Optional[float]]]],
+    ) -> Any:
+        try:
+            value, ttl = await loader()
+            self.put(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._items),
+            "inflight": len(self._inflight),
+        }
+
+
+meta_cache = MetaCache(ttl=META_CACHE_TTL_MINUTES * 60, max_entries=META_CACHE_SIZE)
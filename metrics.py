@@ -0,0 +1,260 @@
+# metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from config import METRICS_HOST, METRICS_PORT
+from httpserver import start_server
+from logs import get_logger
+
+log = get_logger("metrics")
+
+# формат текущей задачи — чтобы mybot подписывал метрики загрузки,
+# не протаскивая format_id через все сигнатуры
+job_format: ContextVar[str] = ContextVar("job_format", default="")
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        # пишут и из event loop, и из потоков скачивания
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Gauge(_Metric):
+    """Значения снимаются в момент запроса метрик функцией collect()."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...],
+        collect: Callable[[], Dict[LabelValues, float]],
+    ):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # key -> [счётчики по бакетам..., +Inf, сумма]
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            cumulative += row[len(self.buckets)]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+            plain = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{plain} {row[-1]}"
+            yield f"{self.name}_count{plain} {cumulative}"
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# ------------------------ метрики бота ------------------------ #
+stage_seconds = Histogram(
+    "ytbot_stage_seconds",
+    "Длительность этапов задачи: extract, download, upload, attach",
+    ("stage", "media_type", "format"),
+)
+stage_bytes = Counter(
+    "ytbot_stage_bytes_total",
+    "Сколько байт скачано/загружено",
+    ("stage", "media_type", "format"),
+)
+stage_throughput = Histogram(
+    "ytbot_stage_bytes_per_second",
+    "Скорость скачивания/загрузки одной задачи, байт/с",
+    ("stage", "media_type"),
+    buckets=(1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8),
+)
+attach_retries = Counter(
+    "ytbot_attach_retries_total",
+    "Повторы /messages из-за attachment.not.ready",
+    ("media_type",),
+)
+errors = Counter(
+    "ytbot_errors_total",
+    "Ошибки по этапам и классам исключений",
+    ("stage", "error"),
+)
+api_queue_wait = Histogram(
+    "ytbot_api_queue_wait_seconds",
+    "Ожидание своей очереди к MAX API (наш лимит частоты и 429)",
+    ("endpoint", "priority"),
+    buckets=(0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+api_request_seconds = Histogram(
+    "ytbot_api_request_seconds",
+    "Длительность запроса к MAX API без ожидания в очереди",
+    ("endpoint", "status"),
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+api_retries = Counter(
+    "ytbot_api_retries_total",
+    "Повторы запросов к MAX API после 429/5xx",
+    ("endpoint", "status"),
+)
+
+
+def observe_transfer(stage: str, size: int, seconds: float, media_type: str = "", format: str = "") -> None:
+    """Одна запись о скачивании/загрузке: длительность, байты и скорость."""
+    stage_seconds.observe(seconds, stage=stage, media_type=media_type, format=format)
+    stage_bytes.inc(size, stage=stage, media_type=media_type, format=format)
+    if seconds > 0:
+        stage_throughput.observe(size / seconds, stage=stage, media_type=media_type)
+
+
+def register_cache(name: str, stats: Callable[[], Dict[str, int]]) -> None:
+    """Счётчики кэша (hits/misses/...) и доля попаданий — читаются при запросе метрик."""
+    Gauge(
+        f"ytbot_{name}_cache",
+        f"Состояние кэша {name}",
+        ("field",),
+        lambda: {(k,): v for k, v in stats().items()},
+    )
+
+    def ratio() -> Dict[LabelValues, float]:
+        s = stats()
+        total = s.get("hits", 0) + s.get("misses", 0)
+        return {(): s.get("hits", 0) / total if total else 0.0}
+
+    Gauge(f"ytbot_{name}_cache_hit_ratio", f"Доля попаданий в кэш {name}", (), ratio)
+
+
+def register_stats(name: str, help: str, stats: Callable[[], Dict[str, int]]) -> None:
+    """Словарь stats() как набор gauge с меткой field."""
+    Gauge(name, help, ("field",), lambda: {(k,): v for k, v in stats().items()})
+
+
+def register_queue(name: str, stats: Callable[[], Dict[str, int]]) -> None:
+    register_stats(f"ytbot_{name}_queue", f"Глубина очереди {name}", stats)
+
+
+# ------------------------ HTTP-эндпоинт ------------------------ #
+_server = None
+
+# текстовые отчёты рядом с /metrics: path -> render()
+_pages: Dict[str, Callable[[], str]] = {}
+
+
+def register_page(path: str, render: Callable[[], str]) -> None:
+    _pages[path] = render
+
+
+async def _handle(
+    method: str, path: str, query: str, headers: Dict[str, str], body: bytes
+) -> Tuple[int, str, bytes]:
+    if path in _pages:
+        return 200, "text/plain; charset=utf-8", _pages[path]().encode()
+    if path != "/metrics":
+        return 404, "text/plain", b"not found"
+    return 200, "text/plain; version=0.0.4", render().encode()
+
+
+async def start_metrics_server() -> None:
+    """Prometheus-эндпоинт /metrics; METRICS_PORT=0 — выключен."""
+    global _server
+    if not METRICS_PORT:
+        return
+    _server = await start_server(_handle, METRICS_HOST, METRICS_PORT)
+    log.info("listening", url=f"http://{METRICS_HOST}:{METRICS_PORT}/metrics")
@@ -1,42 +1,294 @@
 # mybot.py
 import mimetypes
 import asyncio
+import os
+import time
 import httpx
 
-from typing import Optional
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from uuid import uuid4
 from maxbot.bot import Bot as BaseBot
 from maxbot.types import InlineKeyboardMarkup
 
+from attachment_cache import attachment_cache, file_digest
+from governor import PRIORITY_BULK, PRIORITY_CALLBACK, PRIORITY_MESSAGE, RequestGovernor
+from logs import get_logger
+from progress import upload_progress
+from metrics import attach_retries, errors, job_format, observe_transfer, stage_seconds, timer
+from readiness import readiness
+from config import (
+    API_BURST,
+    API_MAX_BACKOFF,
+    API_MAX_RETRIES,
+    API_RATE,
+    LOG_SAMPLE_RATE,
+    UPLOAD_CHUNK_KB,
+    UPLOAD_CONNECT_TIMEOUT,
+    UPLOAD_MAX_CONNECTIONS,
+    UPLOAD_PARALLEL_PARTS,
+    UPLOAD_READ_TIMEOUT,
+    UPLOAD_WRITE_TIMEOUT,
+)
+
+log = get_logger("mybot")
+
+# приоритет по эндпоинту; сообщения с файлами понижаются до bulk отдельно
+ENDPOINT_PRIORITY = {
+    "/answers": PRIORITY_CALLBACK,
+    "/uploads": PRIORITY_BULK,
+}
+
+# типы, для которых token приходит в ответе POST /uploads, а сама
+# загрузка отвечает <retval>1</retval> вместо JSON
+TOKEN_IN_UPLOADS = ("audio", "video")
+
+
+def _chat_key(params: Optional[dict]) -> Optional[str]:
+    """Ключ порядка: запросы с одним ключом уходят строго друг за другом."""
+    if not params:
+        return None
+    if params.get("chat_id"):
+        return f"chat:{params['chat_id']}"
+    if params.get("user_id"):
+        return f"user:{params['user_id']}"
+    if params.get("message_id"):
+        return f"message:{params['message_id']}"
+    return None
+
+
+class PartRejected(RuntimeError):
+    """MAX не принял сообщение с одной из частей файла (send_parts)."""
+
+    def __init__(self, part: str, status: int):
+        super().__init__(f"part {part} rejected: HTTP {status}")
+        self.part = part
+        self.status = status
+
+
+@dataclass
+class UploadResult:
+    token: str
+    size: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Скорость загрузки, байт/с."""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+
+async def _iter_file(file_path: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """Читаем файл кусками в executor'е — в памяти не больше одного куска."""
+    f = await asyncio.to_thread(open, file_path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def _multipart_parts(filename: str, mime_type: str, boundary: str) -> tuple[bytes, bytes]:
+    """Заголовок и хвост multipart/form-data с одним полем data."""
+    safe_name = filename.replace("\\", "\\\\").replace('"', "%22")
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="data"; filename="{safe_name}"\r\n'
+        f"Content-Type: {mime_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head, tail
+
+
+async def _multipart_stream(
+    head: bytes, chunks: AsyncIterator[bytes], tail: bytes
+) -> AsyncIterator[bytes]:
+    yield head
+    async for chunk in chunks:
+        yield chunk
+    yield tail
+
 
 class Bot(BaseBot):
-    async def upload_file(self, file_path: str, media_type: str) -> str:
-        # 1. Получаем URL загрузки (это уже умеет BaseBot._request)
+    def __init__(self, token: str):
+        super().__init__(token)
+        # фоновые отправки (send_file(wait=False)) — держим ссылки до завершения
+        self._background: set = set()
+        # отдельный долгоживущий пул для загрузок: keep-alive к upload-серверу
+        # и большие файлы не занимают соединения обычных API-запросов
+        self.upload_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=UPLOAD_MAX_CONNECTIONS,
+                max_keepalive_connections=UPLOAD_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(
+                connect=UPLOAD_CONNECT_TIMEOUT,
+                read=UPLOAD_READ_TIMEOUT,
+                write=UPLOAD_WRITE_TIMEOUT,
+                pool=None,
+            ),
+        )
+        # все запросы к API (кроме long polling) идут через общую очередь
+        self.governor = RequestGovernor(API_RATE, API_BURST, API_MAX_RETRIES, API_MAX_BACKOFF)
+
+    async def _governed(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        json: Optional[dict] = None,
+        priority: Optional[int] = None,
+        timeout: float = 30.0,
+    ) -> httpx.Response:
+        """Запрос к API через RequestGovernor; 429/5xx он повторит сам."""
+        if priority is None:
+            priority = ENDPOINT_PRIORITY.get(path, PRIORITY_MESSAGE)
+        return await self.governor.call(
+            lambda: self.client.request(
+                method,
+                self.base_url + path,
+                params=params,
+                json=json,
+                headers={"Content-Type": "application/json", "Authorization": self.token},
+                timeout=httpx.Timeout(timeout),
+            ),
+            priority=priority,
+            chat=_chat_key(params),
+            endpoint=path,
+        )
+
+    async def _request(self, method: str, path: str, params=None, json=None, headers=None):
+        # long polling не расходует лимит: это один висящий запрос
+        if path == "/updates":
+            return await super()._request(method, path, params=params, json=json, headers=headers)
+        try:
+            response = await self._governed(method, path, params, json)
+        except httpx.ReadTimeout:
+            # как в BaseBot: таймаут чтения — пустой ответ
+            return {}
+        if response.is_error:
+            log.warning("api error", endpoint=path, status=response.status_code, body=response.text)
+        response.raise_for_status()
+        return response.json()
+
+    async def update_message(
+        self,
+        message_id: str,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        notify: bool = True,
+        format: Optional[str] = None,
+    ) -> httpx.Response:
+        # как в BaseBot, но через очередь: правки одного сообщения — по порядку
+        json_body = {
+            "text": text,
+            "notify": notify,
+            "attachments": [reply_markup.to_attachment()] if reply_markup else [],
+        }
+        if format:
+            json_body["format"] = format
+        return await self._governed("PUT", "/messages", {"message_id": message_id}, json_body)
+
+    async def answer_callback(self, callback_id: str, notification: str):
+        # как в BaseBot, но без print на каждое нажатие
+        log.debug("answer callback", callback_id=callback_id, notification=notification)
+        return await self._request(
+            "POST",
+            "/answers",
+            params={"callback_id": callback_id},
+            json={"notification": notification},
+        )
+
+    async def close(self) -> None:
+        await self.upload_client.aclose()
+        await self.client.aclose()
+
+    async def upload_file(self, file_path: str, media_type: str) -> UploadResult:
+        return await self.upload_stream(
+            _iter_file(file_path, UPLOAD_CHUNK_KB * 1024),
+            os.path.basename(file_path),
+            media_type,
+            size=os.path.getsize(file_path),
+        )
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        media_type: str,
+        size: Optional[int] = None,
+    ) -> UploadResult:
+        """
+        Загружает поток байтов как файл filename.
+        size известен — шлём с Content-Length, иначе chunked.
+        """
+        # 1. Получаем URL загрузки (это уже умеет BaseBot._request);
+        # для audio/video MAX сразу выдаёт и token
         resp = await self._request("POST", "/uploads", params={"type": media_type})
         upload_url = resp["url"]
+        token = resp.get("token") if media_type in TOKEN_IN_UPLOADS else None
 
-        mime_type, _ = mimetypes.guess_type(file_path)
-        with open(file_path, "rb") as f:
-            files = {"data": (file_path, f, mime_type or "application/octet-stream")}
-            async with httpx.AsyncClient() as client:
-                upload_resp = await client.post(upload_url, files=files)
-                upload_resp.raise_for_status()
+        mime_type, _ = mimetypes.guess_type(filename)
+        boundary = uuid4().hex
+        head, tail = _multipart_parts(
+            filename,
+            mime_type or "application/octet-stream",
+            boundary,
+        )
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        if size is not None:
+            headers["Content-Length"] = str(len(head) + size + len(tail))
 
-                print("[DEBUG] upload_resp.status_code:", upload_resp.status_code)
-                print("[DEBUG] upload_resp.text:", upload_resp.text)
+        sent = 0
+        on_progress = upload_progress.get()
 
-                # 🔧 ВАЖНО: НИКАКИХ <retval>, сразу json()
-                try:
-                    result = upload_resp.json()
-                except ValueError:
-                    raise ValueError(
-                        f"Не удалось распарсить JSON в ответе от сервера: {upload_resp.text}"
-                    )
-
-        # 2. Извлекаем токен (новый формат ответа от MAX)
-        token = result.get("token")
+        async def counted() -> AsyncIterator[bytes]:
+            nonlocal sent
+            async for chunk in chunks:
+                sent += len(chunk)
+                if on_progress is not None:
+                    on_progress(sent, size)
+                yield chunk
+
+        # 2. Стримим тело кусками
+        started = time.monotonic()
+        upload_resp = await self.upload_client.post(
+            upload_url,
+            content=_multipart_stream(head, counted(), tail),
+            headers=headers,
+        )
+        seconds = time.monotonic() - started
+        upload_resp.raise_for_status()
+
+        log.debug("upload response", status=upload_resp.status_code, body=upload_resp.text)
+
+        # 3. Извлекаем токен: у file/image он в JSON ответа загрузки
+        # (новый формат ответа от MAX), audio/video отвечают <retval>
         if not token:
-            raise ValueError(f"Не найден токен в ответе: {result}")
-        return token
+            try:
+                result = upload_resp.json()
+            except ValueError:
+                raise ValueError(
+                    f"Не удалось распарсить JSON в ответе от сервера: {upload_resp.text}"
+                )
+            token = result.get("token")
+            if not token:
+                raise ValueError(f"Не найден токен в ответе: {result}")
+
+        observe_transfer("upload", sent, seconds, media_type, job_format.get())
+        upload = UploadResult(token=token, size=sent, seconds=seconds)
+        log.info(
+            "upload done",
+            stage="upload",
+            media_type=media_type,
+            bytes=sent,
+            seconds=round(seconds, 3),
+            mb_per_s=round(upload.throughput / 1e6, 2),
+        )
+        return upload
 
     async def send_file(
         self,
@@ -48,12 +300,209 @@ class Bot(BaseBot):
         reply_markup: Optional[InlineKeyboardMarkup] = None,
         notify: bool = True,
         format: Optional[str] = None,
-        max_retries: int = 3,
+        max_retries: Optional[int] = None,
+        cache_key: Optional[str] = None,
+        wait: bool = True,
     ):
+        """
+        cache_key — стабильный ключ содержимого (например, "<video_id>:<format_id>").
+        Если не передан, ключом служит sha256 файла.
+        max_retries=None — попытки ограничены только дедлайном готовности.
+        wait=False — после загрузки не ждать готовности файла: сообщение
+        уйдёт в фоне, а вызывающий сразу получит asyncio.Task.
+        """
+        if cache_key:
+            token_key = f"{media_type}:{cache_key}"
+        else:
+            token_key = f"{media_type}:sha256:{await file_digest(file_path)}"
+
+        return await self._send_uploaded(
+            lambda: self.upload_file(file_path, media_type),
+            token_key, media_type, chat_id, user_id, text,
+            reply_markup, notify, format, max_retries, wait,
+        )
+
+    async def send_parts(
+        self,
+        file_paths: List[str],
+        media_type: str,
+        chat_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        text: str = "",
+        cache_key: Optional[str] = None,
+    ) -> list:
+        """
+        Файл, порезанный на части: части грузятся одновременно (не больше
+        UPLOAD_PARALLEL_PARTS, по общему пулу upload_client), а сообщения
+        уходят строго по порядку — часть i, как только она загружена и
+        отправлена часть i-1. Подпись каждой части — "text (i/n)".
+        """
+        n = len(file_paths)
+        if cache_key:
+            keys = [f"{media_type}:{cache_key}:{i + 1}/{n}" for i in range(n)]
+        else:
+            keys = [f"{media_type}:sha256:{await file_digest(p)}" for p in file_paths]
+
+        limit = asyncio.Semaphore(UPLOAD_PARALLEL_PARTS)
+        # прогресс задачи — по всем частям сразу, а не по каждой отдельно
+        on_progress = upload_progress.get()
+        total = sum(os.path.getsize(p) for p in file_paths)
+        sent = [0] * n
+
+        def part_progress(i: int, done: int, _size: Optional[int]) -> None:
+            sent[i] = done
+            on_progress(sum(sent), total)
+
+        async def upload(i: int, path: str) -> UploadResult:
+            async with limit:
+                token = None
+                if on_progress is not None:
+                    token = upload_progress.set(lambda done, size: part_progress(i, done, size))
+                try:
+                    return await self.upload_file(path, media_type)
+                finally:
+                    if token is not None:
+                        upload_progress.reset(token)
+
+        # уже загруженные части (есть token в кэше) не грузим заново
+        uploads: List[Optional[asyncio.Task]] = [
+            None if attachment_cache.get(key) else asyncio.create_task(upload(i, path))
+            for i, (path, key) in enumerate(zip(file_paths, keys))
+        ]
+        responses = []
+        try:
+            for i, (path, key) in enumerate(zip(file_paths, keys)):
+                task = uploads[i]
+                resp = await self._send_uploaded(
+                    (lambda t=task, i=i, p=path: t if t is not None else upload(i, p)),
+                    key, media_type, chat_id, user_id, f"{text} ({i + 1}/{n})",
+                    None, True, None, None,
+                )
+                if resp.status_code >= 400:
+                    raise PartRejected(f"{i + 1}/{n}", resp.status_code)
+                responses.append(resp)
+        finally:
+            for task in uploads:
+                if task is not None and not task.done():
+                    task.cancel()
+        return responses
+
+    async def send_stream(
+        self,
+        open_stream: Callable[[], AsyncIterator[bytes]],
+        filename: str,
+        media_type: str,
+        cache_key: str,
+        size: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        text: str = "",
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        notify: bool = True,
+        format: Optional[str] = None,
+        max_retries: Optional[int] = None,
+        wait: bool = True,
+    ):
+        """
+        Как send_file, но тело берётся из open_stream() по мере поступления.
+        Поток открывается, только если в кэше нет годного token.
+        """
+        return await self._send_uploaded(
+            lambda: self.upload_stream(open_stream(), filename, media_type, size),
+            f"{media_type}:{cache_key}", media_type, chat_id, user_id, text,
+            reply_markup, notify, format, max_retries, wait,
+        )
+
+    async def _send_uploaded(
+        self,
+        upload: Callable[[], Awaitable[UploadResult]],
+        token_key: str,
+        media_type: str,
+        chat_id: Optional[int],
+        user_id: Optional[int],
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup],
+        notify: bool,
+        format: Optional[str],
+        max_retries: Optional[int],
+        wait: bool = True,
+    ):
+        # 0. Такой файл уже загружали — пробуем прикрепить сохранённый token
+        token = attachment_cache.get(token_key)
+        if token:
+            resp = await self._send_attachment(
+                token, media_type, chat_id, user_id, text,
+                reply_markup, notify, format, max_retries,
+            )
+            if resp.status_code < 400:
+                return resp
+            # MAX не принял старый token — загружаем файл заново
+            log.warning("cached token rejected, re-upload", stage="attach", status=resp.status_code)
+            attachment_cache.invalidate(token_key)
+
         # 1. Загружаем файл и получаем token
-        token = await self.upload_file(file_path, media_type)
-        await asyncio.sleep(1)  # небольшая задержка, чтобы файл "подхватился" на стороне MAX
+        try:
+            result = await upload()
+        except Exception as e:
+            errors.inc(stage="upload", error=type(e).__name__)
+            raise
+
+        # 2. Ждём, пока MAX обработает файл, и отправляем сообщение
+        attach = self._attach_uploaded(
+            result, token_key, media_type, chat_id, user_id, text,
+            reply_markup, notify, format, max_retries,
+        )
+        if wait:
+            return await attach
 
+        task = asyncio.create_task(attach)
+        self._background.add(task)
+        task.add_done_callback(self._attach_done)
+        return task
+
+    async def _attach_uploaded(
+        self,
+        upload: UploadResult,
+        token_key: str,
+        media_type: str,
+        chat_id: Optional[int],
+        user_id: Optional[int],
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup],
+        notify: bool,
+        format: Optional[str],
+        max_retries: Optional[int],
+    ):
+        resp = await self._send_attachment(
+            upload.token, media_type, chat_id, user_id, text,
+            reply_markup, notify, format, max_retries, size=upload.size,
+        )
+        if resp.status_code < 400:
+            attachment_cache.put(token_key, upload.token)
+        else:
+            errors.inc(stage="attach", error=f"HTTP{resp.status_code}")
+        return resp
+
+    def _attach_done(self, task: "asyncio.Task") -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors.inc(stage="attach", error=type(task.exception()).__name__)
+            log.error("background attach failed", stage="attach", error=repr(task.exception()))
+
+    async def _send_attachment(
+        self,
+        token: str,
+        media_type: str,
+        chat_id: Optional[int],
+        user_id: Optional[int],
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup],
+        notify: bool,
+        format: Optional[str],
+        max_retries: Optional[int],
+        size: Optional[int] = None,
+    ):
+        """size — размер только что загруженного файла; None — token уже проверенный."""
         attachments = [
             {
                 "type": media_type,
@@ -79,29 +528,66 @@ class Bot(BaseBot):
         if format:
             json_body["format"] = format
 
-        print("[send_file] params:", params)
-        print("[send_file] json:", json_body)
+        log.debug("send attachment", params=params, body=json_body)
 
-        delay = 2
+        with timer(stage_seconds, stage="attach", media_type=media_type, format=job_format.get()):
+            return await self._post_message(params, json_body, media_type, max_retries, size)
+
+    async def _post_message(
+        self,
+        params: dict,
+        json_body: dict,
+        media_type: str,
+        max_retries: Optional[int],
+        size: Optional[int],
+    ):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + readiness.deadline(media_type, size or 0)
+        delays = readiness.delays(media_type, size or 0)
+
+        first_delay = next(delays)
+        if size is not None:
+            # свежая загрузка: первая попытка — через ожидаемое время обработки
+            await asyncio.sleep(first_delay)
+
+        attempt = 0
         resp = None
-        for attempt in range(1, max_retries + 1):
-            resp = await self.client.post(
-                f"{self.base_url}/messages",
-                params=params,
-                json=json_body,
-                headers={"Content-Type": "application/json"},
-                timeout=60,
+        while True:
+            attempt += 1
+            resp = await self._governed(
+                "POST", "/messages", params, json_body, priority=PRIORITY_BULK, timeout=60
+            )
+            log.debug(
+                "attach attempt",
+                sample=LOG_SAMPLE_RATE,
+                stage="attach",
+                attempt=attempt,
+                status=resp.status_code,
+                body=resp.text,
             )
-            print(f"Attempt {attempt}: RESP:", resp.status_code)
-            print("RESP_TEXT:", resp.text)
 
             if resp.status_code != 400:
+                if resp.status_code < 400 and size is not None:
+                    readiness.record(media_type, size, loop.time() - started, attempt)
                 return resp
 
-            if "attachment.not.ready" in resp.text or "not.processed" in resp.text:
-                print(f"Жду {delay} секунд и пробую ещё раз...")
-                await asyncio.sleep(delay)
-            else:
+            if "attachment.not.ready" not in resp.text and "not.processed" not in resp.text:
+                break
+            if max_retries is not None and attempt >= max_retries:
                 break
+            delay = next(delays)
+            if loop.time() + delay > deadline:
+                break
+
+            log.debug(
+                "attachment not ready, retry",
+                sample=LOG_SAMPLE_RATE,
+                stage="attach",
+                attempt=attempt,
+                delay=round(delay, 2),
+            )
+            attach_retries.inc(media_type=media_type)
+            await asyncio.sleep(delay)
 
         return resp
@@ -0,0 +1,136 @@
+# pipeline.py
+import asyncio
+import sys
+from typing import Any, AsyncIterator, Callable, Optional
+
+from config import DL_HTTP_CHUNK_MB, DL_RETRIES, PIPELINE_BUFFER_MB, PIPELINE_CHUNK_KB
+from logs import get_logger
+from ytdl import FormatRecord
+
+log = get_logger("pipeline")
+
+# протоколы, которые yt-dlp отдаёт одним файлом без склейки фрагментов
+STREAMABLE_PROTOCOLS = ("https", "http")
+# сколько последних байт stderr yt-dlp хранить для текста ошибки
+STDERR_TAIL = 4096
+
+
+def can_pipeline(fmt: FormatRecord) -> bool:
+    """
+    Стримить «на лету» можно только цельный прогрессивный формат:
+    и видео, и аудио в одном файле, обычный http(s), без muxing'а.
+    """
+    return (
+        fmt.vcodec not in (None, "none")
+        and fmt.acodec not in (None, "none")
+        and fmt.protocol in STREAMABLE_PROTOCOLS
+    )
+
+
+async def stream_format(url: str, format_id: str) -> AsyncIterator[bytes]:
+    """
+    Запускает yt-dlp с выводом в stdout и отдаёт байты по мере скачивания.
+    Между скачиванием и загрузкой — ограниченный буфер (PIPELINE_BUFFER_MB):
+    yt-dlp может уйти вперёд не больше чем на него, дальше упирается в pipe.
+    Ненулевой код выхода yt-dlp превращается в исключение в конце потока,
+    чтобы загрузка не завершилась «успешно» с обрезанным файлом.
+    """
+    chunk_size = PIPELINE_CHUNK_KB * 1024
+    buffer: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(
+        maxsize=max(1, PIPELINE_BUFFER_MB * 1024 // PIPELINE_CHUNK_KB)
+    )
+
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "yt_dlp",
+        "--quiet", "--no-warnings", "--no-playlist", "--no-part",
+        "--http-chunk-size", f"{DL_HTTP_CHUNK_MB}M",
+        "--retries", str(DL_RETRIES),
+        "-f", format_id,
+        "-o", "-",
+        url,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def reader() -> None:
+        try:
+            while True:
+                chunk = await proc.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                await buffer.put(chunk)
+        except Exception:
+            await buffer.put(None)
+            raise
+        await buffer.put(None)
+
+    stderr_tail = bytearray()
+
+    async def drain_stderr() -> None:
+        # читаем stderr всё время работы: иначе болтливый yt-dlp
+        # (повторы, предупреждения) забьёт pipe и встанет вместе с загрузкой
+        while True:
+            data = await proc.stderr.read(64 * 1024)
+            if not data:
+                break
+            stderr_tail.extend(data)
+            del stderr_tail[:-STDERR_TAIL]
+
+    reader_task = asyncio.create_task(reader())
+    stderr_task = asyncio.create_task(drain_stderr())
+    try:
+        while True:
+            chunk = await buffer.get()
+            if chunk is None:
+                break
+            yield chunk
+
+        await reader_task
+        await stderr_task
+        if await proc.wait() != 0:
+            raise RuntimeError(
+                f"yt-dlp завершился с кодом {proc.returncode}: "
+                f"{stderr_tail.decode(errors='replace')[-500:]}"
+            )
+    finally:
+        reader_task.cancel()
+        stderr_task.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def send_pipelined(
+    bot: Any,
+    url: str,
+    fmt: FormatRecord,
+    filename: str,
+    cache_key: str,
+    user_id: int,
+    text: str,
+    slot: Callable[[], Any],
+) -> Optional[Any]:
+    """
+    Скачивание и загрузка в MAX одновременно, без файла на диске.
+    slot() — контекстный менеджер места в очереди загрузок.
+    Возвращает ответ /messages или None, если что-то сломалось —
+    тогда вызывающий идёт обычным путём «скачать, потом загрузить».
+    """
+    size = fmt.filesize  # только точный размер, approx для Content-Length не годится
+    try:
+        async with slot():
+            return await bot.send_stream(
+                lambda: stream_format(url, fmt.format_id),
+                filename=filename,
+                media_type="file",
+                cache_key=cache_key,
+                size=size,
+                user_id=user_id,
+                text=text,
+            )
+    except Exception as e:
+        log.warning("fallback to two-phase download", stage="pipeline", error=f"{type(e).__name__}: {e}")
+        return None
@@ -0,0 +1,168 @@
+# progress.py
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from maxbot.types import InlineKeyboardMarkup
+
+from config import PROGRESS_EDIT_SECONDS, PROGRESS_MIN_STEP
+from logs import get_logger
+
+log = get_logger("progress")
+
+# прогресс загрузки в MAX текущей задачи: mybot.upload_stream зовёт его
+# на каждый кусок, не протаскивая колбэк через send_file/send_stream
+upload_progress: ContextVar[Optional[Callable[[int, Optional[int]], None]]] = ContextVar(
+    "upload_progress", default=None
+)
+
+# как часто поток yt-dlp будит event loop (секунды)
+HOOK_INTERVAL = 0.5
+
+STAGE_TEXT = {
+    "download": "Скачиваю файл... ⏬",
+    "upload": "Отправляю в MAX... ⏫",
+}
+
+MB = 1024 * 1024
+
+
+def _message_id(resp: Any) -> Optional[str]:
+    """mid из ответа POST /messages."""
+    if isinstance(resp, dict):
+        return ((resp.get("message") or {}).get("body") or {}).get("mid")
+    return None
+
+
+class StatusMessage:
+    """
+    Одно сообщение о ходе задачи, которое правится на месте.
+
+    show() — смена этапа или итог: первый вызов отправляет сообщение,
+    следующие правят его сразу. Прогресс скачивания (progress_hooks
+    yt-dlp) и загрузки в MAX идёт через progress(): правка не чаще
+    interval секунд и только если процент сдвинулся на min_step,
+    промежуточные значения схлопываются в последнее.
+    """
+
+    def __init__(
+        self,
+        bot: Any,
+        user_id: int,
+        interval: float = PROGRESS_EDIT_SECONDS,
+        min_step: int = PROGRESS_MIN_STEP,
+        mid: Optional[str] = None,
+    ):
+        self.bot = bot
+        self.user_id = user_id
+        self.interval = interval
+        self.min_step = min_step
+
+        # mid уже отправленного сообщения — например, после рестарта
+        self.mid: Optional[str] = mid
+        self._text = ""
+        self._pending: Optional[str] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_edit = 0.0
+        self._stage = ""
+        self._percent = -1
+        # части загрузки (видео и звук пары качаются отдельно):
+        # format_id -> (скачано, всего)
+        self._parts: Dict[str, Tuple[int, Optional[int]]] = {}
+
+        self.edits = 0
+
+    # ------------------------ этапы ------------------------ #
+    async def show(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Показывает text сразу; отложенная правка прогресса отменяется."""
+        self._pending = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        if self.mid is None:
+            resp = await self.bot.send_message(
+                user_id=self.user_id, text=text, reply_markup=reply_markup
+            )
+            self.mid = _message_id(resp)
+            self._text = text
+            self._last_edit = time.monotonic()
+            return
+        if text != self._text or reply_markup is not None:
+            await self._edit(text, reply_markup)
+
+    async def _edit(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        self._text = text
+        self._last_edit = time.monotonic()
+        self.edits += 1
+        try:
+            resp = await self.bot.update_message(self.mid, text, reply_markup=reply_markup)
+            resp.raise_for_status()
+        except Exception as e:
+            # статус не критичен: задача идёт дальше и без него
+            log.warning("status edit failed", mid=self.mid, error=repr(e))
+
+    # ------------------------ прогресс ------------------------ #
+    def progress(self, stage: str, done: int, total: Optional[int]) -> None:
+        """Из event loop: новое значение прогресса этапа stage."""
+        if self.mid is None:
+            return
+        percent = min(int(done * 100 / total), 100) if total else -1
+        if stage == self._stage and percent >= 0 and percent - self._percent < self.min_step:
+            return
+        self._stage = stage
+        self._percent = percent
+
+        text = STAGE_TEXT.get(stage, stage)
+        if percent >= 0:
+            text += f"\n{percent}% · {done / MB:.1f} из {total / MB:.1f} МБ"
+        else:
+            text += f"\n{done / MB:.1f} МБ"
+        self._pending = text
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            delay = self._last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self._pending = self._pending, None
+            if text and text != self._text:
+                await self._edit(text)
+        finally:
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    def upload_hook(self, sent: int, size: Optional[int]) -> None:
+        self.progress("upload", sent, size)
+
+    def download_hook(self) -> Callable[[Dict[str, Any]], None]:
+        """
+        progress_hook для yt-dlp. Вызывается в потоке скачивания на каждый
+        блок, поэтому event loop будим не чаще HOOK_INTERVAL.
+        """
+        loop = asyncio.get_running_loop()
+        last = [0.0]
+
+        def hook(d: Dict[str, Any]) -> None:
+            if d.get("status") != "downloading":
+                return
+            key = (d.get("info_dict") or {}).get("format_id") or ""
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            self._parts[key] = (d.get("downloaded_bytes") or 0, total)
+            now = time.monotonic()
+            if now - last[0] < HOOK_INTERVAL:
+                return
+            last[0] = now
+            loop.call_soon_threadsafe(self._on_download)
+
+        return hook
+
+    def _on_download(self) -> None:
+        parts = list(self._parts.values())
+        done = sum(p[0] for p in parts)
+        totals = [p[1] for p in parts]
+        total = sum(totals) if all(totals) else None
+        self.progress("download", done, total)
@@ -0,0 +1,79 @@
+# readiness.py
+import random
+from typing import Dict, Iterator
+
+from config import (
+    ATTACH_BASE_DELAY,
+    ATTACH_DEADLINE,
+    ATTACH_MAX_DELAY,
+    ATTACH_SECONDS_PER_MB,
+)
+
+MB = 1024 * 1024
+
+# вес нового наблюдения в скользящем среднем
+EWMA_ALPHA = 0.2
+# если файл был готов с первой попытки, мы могли ждать дольше нужного:
+# слегка уменьшаем оценку, чтобы она не застревала наверху
+FIRST_TRY_SHRINK = 0.8
+
+
+class ReadinessPolicy:
+    """
+    Сколько ждать, пока MAX обработает загруженный файл.
+
+    Время обработки растёт с размером, поэтому учим «секунд на МБ»
+    отдельно для каждого media_type (скользящее среднее по успешным
+    отправкам). Первая попытка — через оценку для этого размера,
+    дальше экспоненциальный backoff с джиттером, всё в пределах дедлайна.
+    """
+
+    def __init__(
+        self,
+        base_delay: float,
+        seconds_per_mb: float,
+        max_delay: float,
+        deadline: float,
+    ):
+        self.base_delay = base_delay
+        self.prior_rate = seconds_per_mb
+        self.max_delay = max_delay
+        self.min_deadline = deadline
+        self._rate: Dict[str, float] = {}
+
+    def estimate(self, media_type: str, size: int) -> float:
+        rate = self._rate.get(media_type, self.prior_rate)
+        return self.base_delay + rate * size / MB
+
+    def deadline(self, media_type: str, size: int) -> float:
+        """Сколько всего ждать готовности, прежде чем сдаться."""
+        return max(self.min_deadline, 4 * self.estimate(media_type, size))
+
+    def delays(self, media_type: str, size: int) -> Iterator[float]:
+        """Паузы перед каждой попыткой: сначала оценка, потом backoff с джиттером."""
+        estimate = self.estimate(media_type, size)
+        yield min(estimate, self.max_delay)
+        step = max(self.base_delay, estimate / 2)
+        while True:
+            step = min(step, self.max_delay)
+            yield random.uniform(step / 2, step)
+            step *= 2
+
+    def record(self, media_type: str, size: int, seconds: float, attempts: int) -> None:
+        """Файл стал готов через seconds после загрузки, за attempts попыток."""
+        if attempts == 1:
+            seconds *= FIRST_TRY_SHRINK
+        sample = max(0.0, seconds - self.base_delay) / max(size / MB, 1.0)
+        old = self._rate.get(media_type, self.prior_rate)
+        self._rate[media_type] = old + EWMA_ALPHA * (sample - old)
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self._rate)
+
+
+readiness = ReadinessPolicy(
+    base_delay=ATTACH_BASE_DELAY,
+    seconds_per_mb=ATTACH_SECONDS_PER_MB,
+    max_delay=ATTACH_MAX_DELAY,
+    deadline=ATTACH_DEADLINE,
+)
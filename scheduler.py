@@ -0,0 +1,206 @@
+# scheduler.py
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from config import (
+    DOWNLOAD_QUEUE_PER_USER,
+    DOWNLOAD_QUEUE_SIZE,
+    DOWNLOAD_WORKERS,
+    EXTRACT_WORKERS,
+)
+
+
+class QueueFull(Exception):
+    """Очередь загрузок переполнена (общая или у конкретного пользователя)."""
+
+
+class _Job:
+    __slots__ = ("user_id", "fn", "args", "future", "started")
+
+    def __init__(self, user_id: int, fn: Optional[Callable[..., Any]], args: tuple, future: "asyncio.Future[Any]"):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.started = False
+
+
+class JobScheduler:
+    """
+    Планировщик тяжёлых задач yt-dlp.
+
+    - извлечение метаданных и скачивание идут в разные пулы потоков;
+    - одновременно качается не больше download_workers файлов;
+    - ожидающие загрузки раздаются по кругу между пользователями
+      (у каждого своя очередь), так что один пользователь с десятком
+      нажатий не забивает всех остальных;
+    - при переполнении очереди сразу бросаем QueueFull, а не копим потоки.
+    """
+
+    def __init__(
+        self,
+        extract_workers: int,
+        download_workers: int,
+        max_queue: int,
+        max_per_user: int,
+    ):
+        self.extract_pool = ThreadPoolExecutor(extract_workers, thread_name_prefix="ytdl-extract")
+        self.download_pool = ThreadPoolExecutor(download_workers, thread_name_prefix="ytdl-download")
+        self.max_running = download_workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+
+        # user_id -> очередь его задач; порядок ключей = порядок обхода по кругу
+        self._queues: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+        self._per_user: Dict[int, int] = {}
+        self._queued = 0
+        self._running = 0
+
+    # ------------------------ извлечение ------------------------ #
+    async def run_extract(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.extract_pool, fn, *args)
+
+    # ------------------------ скачивание ------------------------ #
+    async def run_download(
+        self,
+        user_id: int,
+        fn: Optional[Callable[..., Any]],
+        *args: Any,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> Any:
+        """
+        Ставит fn(*args) в очередь пользователя и ждёт результата.
+        Если задача не стартовала сразу, вызывает on_queued(позиция).
+        fn=None — только занять слот (см. download_slot).
+        """
+        if self._queued >= self.max_queue:
+            raise QueueFull("download queue is full")
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            raise QueueFull(f"too many jobs for user {user_id}")
+
+        loop = asyncio.get_running_loop()
+        job = _Job(user_id, fn, args, loop.create_future())
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self._queued += 1
+        self._pump()
+
+        try:
+            if not job.started and on_queued is not None:
+                await on_queued(self.position(job))
+            return await job.future
+        except BaseException:
+            # отмена или ошибка в on_queued: не оставляем задачу в очереди
+            # и не держим занятый слот
+            if not job.started:
+                self._drop(job)
+            elif job.fn is None:
+                self._finish_slot(job.user_id)
+            raise
+
+    @asynccontextmanager
+    async def download_slot(
+        self,
+        user_id: int,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AsyncIterator[None]:
+        """
+        Занимает место среди одновременных загрузок для async-кода
+        (например, потоковой загрузки из подпроцесса) — с той же
+        очередью и справедливостью, что и run_download.
+        """
+        await self.run_download(user_id, None, on_queued=on_queued)
+        try:
+            yield
+        finally:
+            self._finish_slot(user_id)
+
+    def position(self, job: _Job) -> int:
+        """Какой по счёту стартует задача при обходе по кругу (1 — следующая)."""
+        queue = self._queues.get(job.user_id)
+        if queue is None or job not in queue:
+            return 0
+        k = queue.index(job)
+        ahead = k
+        before_user = True
+        for user_id, q in self._queues.items():
+            if user_id == job.user_id:
+                before_user = False
+                continue
+            ahead += min(len(q), k + 1 if before_user else k)
+        return ahead + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "users": len(self._queues),
+        }
+
+    # ------------------------ внутренности ------------------------ #
+    def _pump(self) -> None:
+        while self._running < self.max_running and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._queued -= 1
+            self._start(job)
+
+    def _start(self, job: _Job) -> None:
+        job.started = True
+        self._running += 1
+        if job.fn is None:
+            job.future.set_result(None)
+            return
+        loop = asyncio.get_running_loop()
+        cf = loop.run_in_executor(self.download_pool, job.fn, *job.args)
+        cf.add_done_callback(lambda f: self._finish(job, f))
+
+    def _finish(self, job: _Job, f: "asyncio.Future[Any]") -> None:
+        self._running -= 1
+        self._release_user(job.user_id)
+        if not job.future.done():
+            if f.cancelled():
+                job.future.cancel()
+            elif f.exception() is not None:
+                job.future.set_exception(f.exception())
+            else:
+                job.future.set_result(f.result())
+        self._pump()
+
+    def _finish_slot(self, user_id: int) -> None:
+        self._running -= 1
+        self._release_user(user_id)
+        self._pump()
+
+    def _drop(self, job: _Job) -> None:
+        queue = self._queues.get(job.user_id)
+        if queue is None or job not in queue:
+            return
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.user_id]
+        self._queued -= 1
+        self._release_user(job.user_id)
+
+    def _release_user(self, user_id: int) -> None:
+        left = self._per_user.get(user_id, 0) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
+
+
+scheduler = JobScheduler(
+    extract_workers=EXTRACT_WORKERS,
+    download_workers=DOWNLOAD_WORKERS,
+    max_queue=DOWNLOAD_QUEUE_SIZE,
+    max_per_user=DOWNLOAD_QUEUE_PER_USER,
+)
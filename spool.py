@@ -0,0 +1,214 @@
+# spool.py
+import asyncio
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Collection, Dict, Optional, Set
+from uuid import uuid4
+
+from config import (
+    DOWNLOAD_DIR,
+    SPOOL_DEFAULT_JOB_MB,
+    SPOOL_DIR,
+    SPOOL_MAX_MB,
+    SPOOL_MIN_FREE_MB,
+    SPOOL_ORPHAN_HOURS,
+    SPOOL_SWEEP_MINUTES,
+)
+from journal import journal
+from logs import get_logger
+from media_cache import STALE_STAGING_SECONDS, MediaCache, media_cache
+
+log = get_logger("spool")
+
+MB = 1024 * 1024
+
+# хвосты yt-dlp, которые остаются после обрыва скачивания
+PARTIAL_SUFFIXES = (".part", ".ytdl", ".temp")
+
+
+class SpoolFull(Exception):
+    """Под загрузку не хватает места на диске (или превышен потолок спула)."""
+
+
+class SpoolManager:
+    """
+    Учёт места под загрузки в DOWNLOAD_DIR.
+
+    - задача допускается, только если на диске хватает места под её
+      ожидаемый размер (filesize из метаданных) с запасом min_free,
+      а общий объём спула не выходит за max_bytes; при нехватке сначала
+      вытесняем незанятые файлы из media_cache;
+    - каждая задача качает в свой каталог <root>/<uuid>, который удаляется
+      по выходу из job(), что бы ни случилось;
+    - уборщик при старте и по расписанию сносит брошенное: старые каталоги
+      задач, каталоги пользователей прежней схемы, хвосты .part,
+      временные ytbot_* и недокачанное в кэше.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        cache: MediaCache,
+        max_bytes: int,
+        min_free: int,
+        default_job_bytes: int,
+        orphan_age: float,
+        sweep_interval: float,
+    ):
+        self.root = root
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.default_job_bytes = default_job_bytes
+        self.orphan_age = orphan_age
+        self.sweep_interval = sweep_interval
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._reserved = 0
+        self._jobs: Set[Path] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.admitted = 0
+        self.rejected = 0
+        self.swept = 0
+
+    # ------------------------ допуск задач ------------------------ #
+    def usage(self) -> int:
+        """Занято спулом: файлы кэша + резервы идущих загрузок."""
+        return self.cache.total_bytes + self._reserved
+
+    def _admit(self, size: int) -> None:
+        over = self.usage() + size - self.max_bytes
+        free = shutil.disk_usage(self.root).free - self._reserved - size - self.min_free
+        shortage = max(over, -free, 0)
+        if shortage:
+            self.cache.trim(self.cache.total_bytes - shortage)
+            over = self.usage() + size - self.max_bytes
+            free = shutil.disk_usage(self.root).free - self._reserved - size - self.min_free
+            if over > 0 or free < 0:
+                self.rejected += 1
+                raise SpoolFull(f"no room for {size} bytes")
+        self.admitted += 1
+
+    @asynccontextmanager
+    async def reserve(self, size: Optional[int]) -> AsyncIterator[None]:
+        """
+        Резервирует место под загрузку ожидаемого размера (None — неизвестен,
+        берём default_job_bytes). Бросает SpoolFull, если места нет.
+        """
+        size = size or self.default_job_bytes
+        self._admit(size)
+        self._reserved += size
+        try:
+            yield
+        finally:
+            self._reserved -= size
+
+    @asynccontextmanager
+    async def job(self, size: Optional[int], prefix: str = "") -> AsyncIterator[Path]:
+        """Резерв + отдельный каталог задачи, который удаляется на выходе."""
+        async with self.reserve(size):
+            job_dir = self.root / f"{prefix}{uuid4().hex}"
+            job_dir.mkdir(parents=True)
+            self._jobs.add(job_dir)
+            try:
+                yield job_dir
+            finally:
+                self._jobs.discard(job_dir)
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    # ------------------------ уборка ------------------------ #
+    def _is_orphan(self, path: Path, now: float) -> bool:
+        try:
+            return now - path.stat().st_mtime > self.orphan_age
+        except OSError:
+            return False
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    def sweep(self, keep: Collection[str] = ()) -> int:
+        """
+        Один проход уборщика (блокирующий). keep — каталоги .tmp задач
+        журнала. Возвращает число удалённого.
+        """
+        now = time.time()
+        removed = 0
+
+        # каталоги задач, которые не ведёт этот процесс
+        for path in self.root.iterdir():
+            if path not in self._jobs and self._is_orphan(path, now):
+                self._remove(path)
+                removed += 1
+
+        # всё лишнее в корне DOWNLOAD_DIR: каталоги <user_id>/ прежней
+        # схемы и хвосты .part; кэш и спул живут по своим правилам
+        for path in DOWNLOAD_DIR.iterdir():
+            if path in (self.root, self.cache.root):
+                continue
+            if (path.is_dir() and path.name.isdigit()) or path.name.endswith(PARTIAL_SUFFIXES):
+                if self._is_orphan(path, now):
+                    self._remove(path)
+                    removed += 1
+
+        # временные каталоги старых версий callbacks.py
+        for path in Path(tempfile.gettempdir()).glob("ytbot_*"):
+            if self._is_orphan(path, now):
+                self._remove(path)
+                removed += 1
+
+        # недокачанное в кэше живёт не меньше, чем его может поднять журнал
+        removed += self.cache.sweep_staging(max(self.orphan_age, STALE_STAGING_SECONDS), keep)
+        self.swept += removed
+        return removed
+
+    async def _janitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await asyncio.to_thread(self.sweep, journal.stagings())
+                if removed:
+                    log.info("swept orphans", removed=removed)
+            except Exception:
+                log.exception("sweep failed")
+
+    async def start(self) -> None:
+        """Уборка при старте и фоновый уборщик."""
+        removed = await asyncio.to_thread(self.sweep, journal.stagings())
+        log.info("startup sweep", removed=removed)
+        self._task = asyncio.create_task(self._janitor())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "jobs": len(self._jobs),
+            "reserved_bytes": self._reserved,
+            "usage_bytes": self.usage(),
+            "max_bytes": self.max_bytes,
+            "free_bytes": shutil.disk_usage(self.root).free,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "swept": self.swept,
+        }
+
+
+spool = SpoolManager(
+    root=SPOOL_DIR,
+    cache=media_cache,
+    max_bytes=SPOOL_MAX_MB * MB,
+    min_free=SPOOL_MIN_FREE_MB * MB,
+    default_job_bytes=SPOOL_DEFAULT_JOB_MB * MB,
+    orphan_age=SPOOL_ORPHAN_HOURS * 3600,
+    sweep_interval=SPOOL_SWEEP_MINUTES * 60,
+)
@@ -0,0 +1,145 @@
+# token_store.py
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import db
+from config import TOKEN_STORE_BACKEND, TOKEN_STORE_DB, TOKEN_STORE_SIZE, TOKEN_TTL_HOURS
+
+# чистим sqlite от истёкших токенов не чаще, чем раз в столько секунд
+SWEEP_INTERVAL = 60
+
+
+@dataclass
+class KeyboardEntry:
+    """Что стоит за одной клавиатурой: ссылка и предложенные форматы."""
+
+    url: str
+    formats: List[str]
+    # какие из formats — только звук (аудиозадача вместо видео)
+    audio: List[str] = field(default_factory=list)
+
+
+def _new_token() -> str:
+    # 8 символов urlsafe = 48 бит, коротко для callback_data
+    return secrets.token_urlsafe(6)
+
+
+class MemoryTokenStore:
+    """Токены в памяти процесса: TTL + жёсткий лимит размера (вытесняем старые)."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, Tuple[KeyboardEntry, float]]" = OrderedDict()
+
+    def _sweep(self, now: float) -> None:
+        # TTL одинаковый, поэтому самые старые — в начале
+        while self._items:
+            token, (_, expires_at) = next(iter(self._items.items()))
+            if expires_at > now and len(self._items) <= self.max_entries:
+                break
+            del self._items[token]
+
+    def put(self, url: str, formats: List[str], audio: Sequence[str] = ()) -> str:
+        now = time.monotonic()
+        token = _new_token()
+        while token in self._items:
+            token = _new_token()
+        self._items[token] = (KeyboardEntry(url, list(formats), list(audio)), now + self.ttl)
+        self._sweep(now)
+        return token
+
+    def get(self, token: str) -> Optional[KeyboardEntry]:
+        item = self._items.get(token)
+        if item is None:
+            return None
+        entry, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._items[token]
+            return None
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SqliteTokenStore:
+    """
+    Токены в SQLite: клавиатуры переживают рестарт и работают,
+    даже если кнопку нажали в другом процессе бота.
+    """
+
+    def __init__(self, path: Path, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = db.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keyboard_tokens ("
+            " token TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " formats TEXT NOT NULL,"
+            " expires REAL NOT NULL,"
+            " audio TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(keyboard_tokens)")}
+        if "audio" not in columns:
+            # база от версии без аудиоформатов
+            self._conn.execute(
+                "ALTER TABLE keyboard_tokens ADD COLUMN audio TEXT NOT NULL DEFAULT ''"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS keyboard_tokens_expires ON keyboard_tokens(expires)"
+        )
+        self._last_sweep = 0.0
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self._conn.execute("DELETE FROM keyboard_tokens WHERE expires <= ?", (now,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM keyboard_tokens").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM keyboard_tokens WHERE token IN ("
+                " SELECT token FROM keyboard_tokens ORDER BY expires LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def put(self, url: str, formats: List[str], audio: Sequence[str] = ()) -> str:
+        now = time.time()
+        self._sweep(now)
+        while True:
+            token = _new_token()
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO keyboard_tokens (token, url, formats, expires, audio)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (token, url, ",".join(formats), now + self.ttl, ",".join(audio)),
+            )
+            if cur.rowcount:
+                return token
+
+    def get(self, token: str) -> Optional[KeyboardEntry]:
+        row = self._conn.execute(
+            "SELECT url, formats, expires, audio FROM keyboard_tokens WHERE token = ?",
+            (token,),
+        ).fetchone()
+        if row is None or row[2] <= time.time():
+            return None
+        url, formats, _, audio = row
+        return KeyboardEntry(
+            url,
+            formats.split(",") if formats else [],
+            audio.split(",") if audio else [],
+        )
+
+
+if TOKEN_STORE_BACKEND == "sqlite":
+    token_store = SqliteTokenStore(TOKEN_STORE_DB, TOKEN_TTL_HOURS * 3600, TOKEN_STORE_SIZE)
+elif TOKEN_STORE_BACKEND == "memory":
+    token_store = MemoryTokenStore(TOKEN_TTL_HOURS * 3600, TOKEN_STORE_SIZE)
+else:
+    raise RuntimeError(f"Неизвестный TOKEN_STORE_BACKEND: {TOKEN_STORE_BACKEND}")
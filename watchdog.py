@@ -0,0 +1,236 @@
+# watchdog.py
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as Tally, deque
+from types import FrameType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    BASE_DIR,
+    WATCHDOG_BLOCK_MS,
+    WATCHDOG_ENABLED,
+    WATCHDOG_INTERVAL_MS,
+    WATCHDOG_TOP,
+)
+from logs import get_logger
+from metrics import Counter, Histogram, register_page, register_stats
+
+log = get_logger("watchdog")
+
+loop_lag = Histogram(
+    "ytbot_loop_lag_seconds",
+    "Опоздание таймера event loop: сколько loop был занят чужими колбэками",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+loop_blocked = Counter(
+    "ytbot_loop_blocked_total",
+    "Остановки event loop дольше порога, по месту в коде",
+    ("handler", "site"),
+)
+loop_blocked_seconds = Counter(
+    "ytbot_loop_blocked_seconds_total",
+    "Сколько секунд event loop простоял в остановках, по месту в коде",
+    ("handler", "site"),
+)
+
+# последние замеры опоздания — для перцентилей
+LAG_WINDOW = 2048
+# сколько кадров стека хранить для отчёта
+STACK_FRAMES = 8
+
+
+# кадр, с которого asyncio запускает очередной колбэк: всё, что глубже, —
+# и есть колбэк, занявший loop
+_HANDLE_RUN = asyncio.events.Handle._run.__code__
+
+
+def _is_ours(frame: FrameType) -> bool:
+    path = frame.f_code.co_filename
+    return path.startswith(str(BASE_DIR)) and "site-packages" not in path and path != __file__
+
+
+def _where(frame: FrameType, line: bool = True) -> str:
+    path = frame.f_code.co_filename
+    path = path[len(str(BASE_DIR)) + 1:] if _is_ours(frame) else path.rsplit("/", 1)[-1]
+    return f"{path}:{frame.f_lineno} {frame.f_code.co_name}" if line else f"{path} {frame.f_code.co_name}"
+
+
+def _describe(frame: FrameType) -> Tuple[str, str, str]:
+    """
+    (handler, site, stack) по кадру потока event loop. Смотрим только
+    кадры текущего колбэка: site — самый глубокий кадр нашего кода (что
+    именно блокирует), handler — самый внешний (корутина хендлера).
+    """
+    frames: List[FrameType] = []
+    f: Optional[FrameType] = frame
+    while f is not None and f.f_code is not _HANDLE_RUN:
+        frames.append(f)
+        f = f.f_back
+    stack = "".join(
+        traceback.StackSummary.extract((f, f.f_lineno) for f in reversed(frames[:STACK_FRAMES])).format()
+    )
+    ours = [f for f in frames if _is_ours(f)]
+    if not ours:
+        # блокирует чужой код (библиотека, сам asyncio)
+        return "-", _where(frame), stack
+    return _where(ours[-1], line=False), _where(ours[0]), stack
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+class LoopWatchdog:
+    """
+    Диагностика event loop.
+
+    - таймер каждые interval секунд меряет, насколько он опоздал: это и
+      есть лаг loop, он идёт в гистограмму и в окно для перцентилей;
+    - отдельный поток следит за этим таймером: если тот не срабатывал
+      дольше threshold, loop чем-то занят — поток снимает стек потока
+      loop (sys._current_frames) раз в threshold/2, пока остановка
+      не кончится;
+    - каждая остановка приписывается месту в коде, которое чаще всего
+      попадалось в снимках; по местам копятся число остановок, суммарное
+      и наибольшее время — это и есть рейтинг медленных колбэков.
+    """
+
+    def __init__(self, interval: float, threshold: float, top: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.top = top
+
+        self._lags: Deque[float] = deque(maxlen=LAG_WINDOW)
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # снимки текущей остановки: (handler, site, stack)
+        self._samples: List[Tuple[str, str, str]] = []
+        self._stall_beat = 0.0
+        # site -> {"handler", "count", "seconds", "max", "stack"}
+        self._slow: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    # ------------------------ в event loop ------------------------ #
+    async def _tick(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.observe(lag)
+
+    # ------------------------ в потоке-сторож ------------------------ #
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if self._samples and beat != self._stall_beat:
+                # таймер снова пошёл: остановка длилась от прошлого
+                # срабатывания до нового за вычетом его интервала
+                self._close_stall(beat - self._stall_beat - self.interval)
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._stall_beat = beat
+            self._samples.append(_describe(frame))
+            del frame
+
+    def _close_stall(self, seconds: float) -> None:
+        samples, self._samples = self._samples, []
+        (handler, site), _ = Tally((h, s) for h, s, _ in samples).most_common(1)[0]
+        stack = next(st for h, s, st in samples if (h, s) == (handler, site))
+        with self._lock:
+            self.stalls += 1
+            entry = self._slow.get(site)
+            if entry is None:
+                entry = self._slow[site] = {"handler": handler, "count": 0, "seconds": 0.0, "max": 0.0}
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["stack"] = stack
+        loop_blocked.inc(handler=handler, site=site)
+        loop_blocked_seconds.inc(seconds, handler=handler, site=site)
+        log.warning(
+            "event loop blocked",
+            seconds=round(seconds, 3),
+            handler=handler,
+            site=site,
+            samples=len(samples),
+        )
+
+    # ------------------------ запуск ------------------------ #
+    async def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._tick())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info("started", interval=self.interval, threshold=self.threshold)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # ------------------------ отчёты ------------------------ #
+    def stats(self) -> Dict[str, float]:
+        lags = list(self._lags)
+        return {
+            "p50_ms": round(_percentile(lags, 50) * 1000, 2),
+            "p95_ms": round(_percentile(lags, 95) * 1000, 2),
+            "p99_ms": round(_percentile(lags, 99) * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+        }
+
+    def slowest(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Места, где loop стоял дольше всего (по суммарному времени)."""
+        with self._lock:
+            items = [(site, dict(entry)) for site, entry in self._slow.items()]
+        items.sort(key=lambda item: item[1]["seconds"], reverse=True)
+        return items[: self.top]
+
+    def report(self) -> str:
+        s = self.stats()
+        lines = [
+            f"loop lag p50 {s['p50_ms']} ms, p95 {s['p95_ms']} ms, p99 {s['p99_ms']} ms,"
+            f" max {s['max_ms']} ms; stalls > {self.threshold * 1000:.0f} ms: {s['stalls']}",
+            "",
+        ]
+        for site, entry in self.slowest():
+            lines.append(
+                f"{entry['seconds']:8.3f}s total  {entry['count']:>5}x  max {entry['max']:.3f}s"
+                f"  {site}  (handler {entry['handler']})"
+            )
+            lines.extend("    " + line for line in entry["stack"].rstrip().splitlines())
+            lines.append("")
+        return "\n".join(lines) + "\n"
+
+
+watchdog = LoopWatchdog(
+    interval=WATCHDOG_INTERVAL_MS / 1000,
+    threshold=WATCHDOG_BLOCK_MS / 1000,
+    top=WATCHDOG_TOP,
+)
+
+if WATCHDOG_ENABLED:
+    register_stats("ytbot_loop_lag", "Лаг event loop: перцентили за последние замеры", watchdog.stats)
+    register_page("/debug/loop", watchdog.report)
@@ -0,0 +1,93 @@
+# webhook.py
+import asyncio
+import hmac
+import json
+from typing import Dict, Tuple
+
+from maxbot.dispatcher import Dispatcher
+
+from config import (
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from httpserver import start_server
+from logs import get_logger
+
+log = get_logger("webhook")
+
+
+class WebhookReceiver:
+    """
+    Приём апдейтов MAX через webhook вместо long polling.
+
+    HTTP-обработчик только проверяет секрет, разбирает JSON и кладёт апдейт
+    в ограниченную очередь диспетчера — ответ 200 уходит сразу, а разбор
+    роутерами делают обычные воркеры Dispatcher. Если очередь переполнена,
+    отвечаем 503, и MAX повторит доставку позже (или балансировщик отправит
+    её другой реплике).
+    """
+
+    def __init__(self, dp: Dispatcher, queue_size: int, secret: str = ""):
+        self.dp = dp
+        self.secret = secret
+        # заменяем безразмерную очередь диспетчера на ограниченную
+        self.dp.queue = asyncio.Queue(maxsize=queue_size)
+
+    async def handle(
+        self, method: str, path: str, query: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, str, bytes]:
+        if path != WEBHOOK_PATH:
+            return 404, "text/plain", b"not found"
+        if method != "POST":
+            return 405, "text/plain", b"method not allowed"
+        if self.secret and not hmac.compare_digest(
+            headers.get("x-max-bot-api-secret", ""), self.secret
+        ):
+            return 401, "text/plain", b"bad secret"
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, "text/plain", b"bad json"
+
+        # обычно один Update на запрос, но принимаем и пачку {"updates": [...]}.
+        # Диспетчер зовёт update.get вне своего try — не-dict убил бы воркер
+        if not isinstance(payload, dict):
+            return 400, "text/plain", b"bad update"
+        updates = payload["updates"] if "updates" in payload else [payload]
+        if not isinstance(updates, list) or not all(isinstance(u, dict) for u in updates):
+            return 400, "text/plain", b"bad update"
+        if self.dp.queue.maxsize and self.dp.queue.qsize() + len(updates) > self.dp.queue.maxsize:
+            return 503, "text/plain", b"busy"
+        for update in updates:
+            self.dp.queue.put_nowait(update)
+        return 200, "application/json", b'{"ok":true}'
+
+    async def subscribe(self, url: str) -> None:
+        """Регистрирует наш публичный URL в MAX (POST /subscriptions)."""
+        body = {"url": url}
+        if self.secret:
+            body["secret"] = self.secret
+        resp = await self.dp.bot._request("POST", "/subscriptions", json=body)
+        log.info("subscription", response=resp)
+
+    async def run(self) -> None:
+        for _ in range(self.dp.workers_count):
+            asyncio.create_task(self.dp.worker())
+
+        server = await start_server(self.handle, WEBHOOK_HOST, WEBHOOK_PORT)
+        log.info("listening", host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH)
+
+        if WEBHOOK_URL:
+            await self.subscribe(WEBHOOK_URL)
+
+        async with server:
+            await server.serve_forever()
+
+
+async def run_webhook(dp: Dispatcher) -> None:
+    await WebhookReceiver(dp, WEBHOOK_QUEUE_SIZE, WEBHOOK_SECRET).run()
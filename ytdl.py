@@ -1,10 +1,33 @@
-import asyncio
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import sanitize_filename
 
-from config import DOWNLOAD_DIR
+from config import (
+    DL_BUFFER_KB,
+    DL_CONNECTION_BUDGET,
+    DL_EXTERNAL_DOWNLOADER,
+    DL_FRAGMENT_RETRIES,
+    DL_FRAGMENTS,
+    DL_FRAGMENTS_LARGE,
+    DL_HTTP_CHUNK_MB,
+    DL_LARGE_MB,
+    DL_RETRIES,
+    UPLOAD_MAX_MB,
+)
+from extract_pool import process_extractor
+from links import extract_video_id
+from meta_cache import meta_cache
+from metrics import observe_transfer, stage_seconds, timer
+from scheduler import scheduler
 
 
 YDL_EXTRACT_OPTS = {
@@ -14,60 +37,280 @@ YDL_EXTRACT_OPTS = {
     "noplaylist": True,
 }
 
+
+@dataclass(slots=True)
+class FormatRecord:
+    """
+    Формат ролика — только то, что нужно дальше (клавиатура, выбор,
+    кэш метаданных). Строится из сырого формата yt-dlp сразу после
+    извлечения: подписанные ссылки, заголовки, фрагменты и
+    downloader_options с ним не живут. __slots__ — записей в кэше
+    метаданных тысячи, а dict на каждую втрое тяжелее.
+    """
+
+    format_id: str
+    ext: Optional[str] = None
+    resolution: Optional[str] = None
+    height: Optional[int] = None
+    abr: Optional[float] = None
+    tbr: Optional[float] = None
+    filesize: Optional[int] = None
+    filesize_approx: Optional[int] = None
+    vcodec: Optional[str] = None
+    acodec: Optional[str] = None
+    protocol: Optional[str] = None
+    # длительность ролика — для нарезки слишком больших файлов по времени
+    duration: Optional[float] = None
+
+    @classmethod
+    def from_info(cls, f: Dict[str, Any], duration: Optional[float] = None) -> "FormatRecord":
+        return cls(
+            format_id=str(f.get("format_id") or ""),
+            ext=f.get("ext"),
+            resolution=f.get("resolution"),
+            height=f.get("height"),
+            abr=f.get("abr"),
+            tbr=f.get("tbr"),
+            filesize=f.get("filesize"),
+            filesize_approx=f.get("filesize_approx"),
+            vcodec=f.get("vcodec"),
+            acodec=f.get("acodec"),
+            protocol=f.get("protocol"),
+            duration=duration,
+        )
+
+    @property
+    def size(self) -> int:
+        """Точный размер, иначе оценка yt-dlp; 0 — неизвестен."""
+        return self.filesize or self.filesize_approx or 0
+
+
+# за сколько секунд до истечения подписанных ссылок считаем форматы устаревшими
+URL_EXPIRY_MARGIN = 300
+
 YDL_DOWNLOAD_OPTS_BASE = {
     "quiet": True,
     "no_warnings": True,
     "noplaylist": True,
+    # недокачанное остаётся в .part/.ytdl и продолжается с того же байта
+    # (после рестарта задача качает в тот же каталог)
+    "continuedl": True,
+    "nopart": False,
 }
 
 
-def _build_download_opts(download_dir: Path, format_id: str | None) -> Dict[str, Any]:
+MB = 1024 * 1024
+
+# протоколы, где файл собирается из фрагментов (DASH/HLS)
+FRAGMENTED_PROTOCOLS = {"m3u8", "m3u8_native", "http_dash_segments", "dash"}
+
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+# части при нарезке берём с запасом: ffmpeg режет по ключевым кадрам
+SPLIT_HEADROOM = 0.9
+
+# внешний загрузчик включаем, только если он реально установлен
+EXTERNAL_DOWNLOADER = (
+    DL_EXTERNAL_DOWNLOADER
+    if DL_EXTERNAL_DOWNLOADER and shutil.which(DL_EXTERNAL_DOWNLOADER)
+    else None
+)
+
+
+@dataclass(frozen=True)
+class DownloadProfile:
+    """Настройки сетевого движка yt-dlp для одной задачи."""
+
+    name: str
+    connections: int  # сколько фрагментов / соединений хотим параллельно
+    http_chunk_size: Optional[int] = None
+    external_downloader: Optional[str] = None
+
+
+def choose_profile(fmt: Optional[FormatRecord]) -> DownloadProfile:
+    """
+    Профиль по протоколу и размеру формата:
+    - DASH/HLS — параллельные фрагменты, крупным больше;
+    - цельный http — запросы кусками (так googlevideo не режет скорость
+      одного соединения), крупные — через внешний загрузчик, если он есть.
+    """
+    large = bool(fmt) and fmt.size >= DL_LARGE_MB * MB
+    protocols = set(((fmt and fmt.protocol) or "").split("+"))
+
+    if protocols & FRAGMENTED_PROTOCOLS:
+        if large:
+            return DownloadProfile("fragmented-large", DL_FRAGMENTS_LARGE)
+        return DownloadProfile("fragmented", DL_FRAGMENTS)
+    if large and EXTERNAL_DOWNLOADER:
+        return DownloadProfile(
+            "http-external", DL_FRAGMENTS_LARGE, external_downloader=EXTERNAL_DOWNLOADER
+        )
+    return DownloadProfile("http", 1, http_chunk_size=DL_HTTP_CHUNK_MB * MB)
+
+
+class _ConnectionBudget:
+    """
+    Общий лимит параллельных соединений всех загрузок. Задача берёт
+    сколько хочет из свободного, но не меньше одного — так крупные
+    задачи ускоряются, а мелкие не ждут, пока им что-то освободят.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, want: int) -> int:
+        with self._lock:
+            n = max(1, min(want, self.total - self.used))
+            self.used += n
+            return n
+
+    def give(self, n: int) -> None:
+        with self._lock:
+            self.used -= n
+
+
+download_budget = _ConnectionBudget(DL_CONNECTION_BUDGET)
+
+
+def _retry_sleep(n: int) -> float:
+    # экспоненциальная пауза между повторами запросов и фрагментов;
+    # yt-dlp зовёт её как sleep_func(n=номер повтора с нуля)
+    return min(0.5 * 2 ** n, 30)
+
+
+def _build_download_opts(
+    download_dir: Path,
+    format_id: str | None,
+    profile: Optional[DownloadProfile] = None,
+    connections: int = 1,
+    audio: Optional[str] = None,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
     opts = YDL_DOWNLOAD_OPTS_BASE.copy()
     opts["outtmpl"] = str(download_dir / "%(title)s.%(ext)s")
     if format_id:
         opts["format"] = format_id
+    if progress:
+        opts["progress_hooks"] = [progress]
+    if audio and FFMPEG:
+        # только смена контейнера: ffmpeg -c:a copy, без перекодирования
+        opts["postprocessors"] = [
+            {"key": "FFmpegExtractAudio", "preferredcodec": audio}
+        ]
+
+    opts["buffersize"] = DL_BUFFER_KB * 1024
+    opts["retries"] = DL_RETRIES
+    opts["fragment_retries"] = DL_FRAGMENT_RETRIES
+    opts["retry_sleep_functions"] = {"http": _retry_sleep, "fragment": _retry_sleep}
+    if profile is None:
+        return opts
+
+    opts["concurrent_fragment_downloads"] = connections
+    if profile.http_chunk_size:
+        opts["http_chunk_size"] = profile.http_chunk_size
+    if profile.external_downloader:
+        opts["external_downloader"] = {"http": profile.external_downloader}
+        if profile.external_downloader == "aria2c":
+            n = str(connections)
+            opts["external_downloader_args"] = {
+                "aria2c": ["-x", n, "-s", n, "-k", "1M", "--summary-interval=0"]
+            }
     return opts
 
 
-async def extract_info(url: str) -> Dict[str, Any]:
+def is_audio_only(f: FormatRecord) -> bool:
+    return f.vcodec == "none" and f.acodec not in (None, "none")
+
+
+def audio_target(f: FormatRecord) -> Optional[str]:
     """
-    Асинхронно вытягивает метаинфу о ролике.
-    Возвращает dict с полями yt-dlp.
+    В какой контейнер перекладываем аудиодорожку без перекодирования:
+    AAC — в m4a, Opus — в .opus; прочее оставляем как есть (None).
     """
-    loop = asyncio.get_running_loop()
+    acodec = f.acodec or ""
+    if acodec.startswith("mp4a"):
+        return "m4a"
+    if acodec == "opus":
+        return "opus"
+    return None
+
 
-    def _extract() -> Dict[str, Any]:
-        with YoutubeDL(YDL_EXTRACT_OPTS) as ydl:
-            return ydl.extract_info(url, download=False)
+def is_merged(f: FormatRecord) -> bool:
+    """Пара «видео+звук», которую склеиваем сами (format_id вида "137+140")."""
+    return "+" in f.format_id
 
-    return await loop.run_in_executor(None, _extract)
 
+def _best_pair(formats: List[FormatRecord], budget: int) -> Optional[FormatRecord]:
+    """
+    Лучшая пара отдельных видео (mp4) и звука (m4a), которая вместе
+    укладывается в budget байт. Предлагаем её, только если она выше
+    лучшего цельного формата — иначе кнопка ничего не даёт.
+    """
+    formats = [f for f in formats if f.size]
+    videos = [
+        f for f in formats
+        if f.acodec == "none" and f.vcodec not in (None, "none") and f.ext == "mp4"
+    ]
+    audios = [f for f in formats if is_audio_only(f) and f.ext == "m4a"]
+    progressive = max(
+        (f.height or 0 for f in formats
+         if f.vcodec not in (None, "none") and f.acodec not in (None, "none")),
+        default=0,
+    )
 
-def _filter_formats(info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    videos.sort(key=lambda f: (f.height or 0, f.tbr or 0), reverse=True)
+    audios.sort(key=lambda f: f.abr or 0, reverse=True)
+    for v in videos:
+        if (v.height or 0) <= progressive:
+            break
+        for a in audios:
+            if v.size + a.size <= budget:
+                return replace(
+                    v,
+                    format_id=f"{v.format_id}+{a.format_id}",
+                    filesize=v.size + a.size,
+                    filesize_approx=None,
+                    acodec=a.acodec,
+                    abr=a.abr,
+                    protocol=f"{v.protocol or ''}+{a.protocol or ''}",
+                )
+    return None
 
-    formats = info.get("formats", [])
-    result: List[Dict[str, Any]] = []
+
+def _filter_formats(formats: List[FormatRecord]) -> List[FormatRecord]:
+    """
+    Цельные форматы (видео + звук) по возрастанию качества,
+    за ними — лучшая аудиодорожка в каждом контейнере.
+    """
+    result: List[FormatRecord] = []
+    best_audio: Dict[str, FormatRecord] = {}
 
     for f in formats:
-        vcodec = f.get("vcodec")
-        acodec = f.get("acodec")
+        if not f.size:
+            continue
 
-        # нужно и видео, и аудио
-        if vcodec == "none" or acodec == "none":
+        if is_audio_only(f):
+            ext = audio_target(f) or f.ext or ""
+            best = best_audio.get(ext)
+            if best is None or (f.abr or 0) > (best.abr or 0):
+                best_audio[ext] = f
             continue
 
-        size = f.get("filesize") or f.get("filesize_approx")
-        if not size:
+        # нужно и видео, и аудио
+        if f.vcodec == "none" or f.acodec == "none":
             continue
 
         result.append(f)
 
     # по желанию: отсортируем по размеру/качеству (не обязательно)
-    result.sort(key=lambda x: (x.get("height") or 0, x.get("filesize") or 0))
+    result.sort(key=lambda x: (x.height or 0, x.filesize or 0))
+    result.extend(sorted(best_audio.values(), key=lambda x: x.abr or 0))
     return result
 
 
-
 def human_bytes(num: int | float) -> str:
     step_unit = 1024.0
     for x in ["B", "KB", "MB", "GB", "TB"]:
@@ -77,33 +320,252 @@ def human_bytes(num: int | float) -> str:
     return f"{num:.1f}PB"
 
 
-async def prepare_formats(url: str) -> Tuple[str, str | None, List[Dict[str, Any]]]:
+def _formats_ttl(info: Dict[str, Any]) -> Optional[float]:
     """
-    Возвращает: (title, thumbnail_url, [список форматов])
-    Каждый формат: dict с полями id, ext, resolution/abr, filesize и т.д.
+    Сколько секунд форматы ещё актуальны: googlevideo-ссылки подписаны
+    и содержат expire=<unix time>. None — срок не известен.
+    """
+    expires = []
+    for f in info.get("formats", []):
+        url = f.get("url")
+        if not url or "expire" not in url:
+            continue
+        values = parse_qs(urlsplit(url).query).get("expire")
+        if values and values[0].isdigit():
+            expires.append(int(values[0]))
+    if not expires:
+        return None
+    return min(expires) - time.time() - URL_EXPIRY_MARGIN
+
+
+def compact_info(info: Dict[str, Any]) -> Tuple[Tuple[str, str | None, List[FormatRecord]], Optional[float]]:
+    """
+    Ужимает полный info из yt-dlp до (title, thumb, форматы) и TTL форматов.
+    Полный info дальше этой функции не уходит: форматы сразу
+    перекладываются в FormatRecord, выбор идёт уже по ним.
     """
-    info = await extract_info(url)
     title = info.get("title", "No title")
     thumb = info.get("thumbnail")
-    fmts = _filter_formats(info)
-    return title, thumb, fmts
+    duration = info.get("duration")
+    records = [FormatRecord.from_info(f, duration) for f in info.get("formats", [])]
+    fmts = _filter_formats(records)
+    # склеить пару без ffmpeg нечем — кнопку не предлагаем
+    pair = _best_pair(records, UPLOAD_MAX_MB * MB) if FFMPEG else None
+    if pair is not None:
+        fmts.append(pair)
+    return (title, thumb, fmts), _formats_ttl(info)
+
+
+def _extract_formats(url: str) -> Tuple[Tuple[str, str | None, List[FormatRecord]], Optional[float]]:
+    """Синхронное извлечение в потоке пула."""
+    with YoutubeDL(YDL_EXTRACT_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+    return compact_info(info)
 
 
-async def download_selected_format(url: str, format_id: str, user_id: int) -> Path:
+async def _load_formats(url: str) -> Tuple[Tuple[str, str | None, List[FormatRecord]], Optional[float]]:
+    with timer(stage_seconds, stage="extract"):
+        if process_extractor.enabled:
+            return await process_extractor.extract(url)
+        return await scheduler.run_extract(_extract_formats, url)
+
+
+async def prepare_formats(url: str) -> Tuple[str, str | None, List[FormatRecord]]:
     """
-    Качает один выбранный формат.
-    Возвращает путь к локальному файлу.
+    Возвращает: (title, thumbnail_url, [список форматов])
+    Каждый формат — FormatRecord (id, ext, resolution/abr, размер, кодеки...).
+    Результат кэшируется по id ролика, одновременные запросы
+    одного и того же ролика делят одно извлечение.
+    """
+    video_id = extract_video_id(url)
+    if not video_id:
+        result, _ = await _load_formats(url)
+        return result
+    return await meta_cache.get_or_load(video_id, lambda: _load_formats(url))
+
+
+def find_cached_format(video_id: str, format_id: str) -> Optional[Tuple[str, FormatRecord]]:
+    """
+    Ищет формат в кэше метаданных, без обращения к yt-dlp.
+    Возвращает (имя файла, формат) или None.
     """
-    user_dir = DOWNLOAD_DIR / str(user_id)
-    user_dir.mkdir(parents=True, exist_ok=True)
+    cached = meta_cache.get(video_id)
+    if cached is None:
+        return None
+    title, _, fmts = cached
+    for f in fmts:
+        if f.format_id == format_id:
+            return f"{sanitize_filename(title)}.{f.ext or 'bin'}", f
+    return None
 
-    loop = asyncio.get_running_loop()
 
-    def _download() -> Path:
-        opts = _build_download_opts(user_dir, format_id)
+def _download_to(
+    url: str,
+    format_id: str,
+    download_dir: Path,
+    profile: Optional[DownloadProfile] = None,
+    audio: Optional[str] = None,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Path:
+    profile = profile or choose_profile(None)
+    connections = download_budget.take(profile.connections)
+    started = time.perf_counter()
+    try:
+        opts = _build_download_opts(download_dir, format_id, profile, connections, audio, progress)
         with YoutubeDL(opts) as ydl:
             info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            return Path(filename)
+            # после постпроцессора (перекладка аудио) имя файла другое
+            downloads = info.get("requested_downloads") or [{}]
+            filename = downloads[0].get("filepath") or ydl.prepare_filename(info)
+    finally:
+        download_budget.give(connections)
+    path = Path(filename)
+    observe_transfer(
+        "download", path.stat().st_size, time.perf_counter() - started, format=format_id
+    )
+    return path
+
+
+def _download_merged(
+    url: str,
+    format_id: str,
+    download_dir: Path,
+    profile: Optional[DownloadProfile] = None,
+    audio: Optional[str] = None,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Path:
+    """
+    Пара "видео+звук": оба потока качаются одновременно (звук — в соседнем
+    потоке), затем ffmpeg склеивает их без перекодирования и переносит
+    moov в начало (+faststart), чтобы ролик начинал играть сразу.
+    """
+    video_fmt, audio_fmt = format_id.split("+", 1)
+    parts = download_dir / ".parts"
+    (parts / "v").mkdir(parents=True, exist_ok=True)
+    (parts / "a").mkdir(parents=True, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(1, thread_name_prefix="ytdl-audio") as pool:
+            audio_job = pool.submit(_download_to, url, audio_fmt, parts / "a", None, None, progress)
+            video_path = _download_to(url, video_fmt, parts / "v", profile, None, progress)
+            audio_path = audio_job.result()
+
+        out = download_dir / f"{video_path.stem}.mp4"
+        started = time.perf_counter()
+        subprocess.run(
+            [
+                FFMPEG, "-v", "error", "-y",
+                "-i", str(video_path), "-i", str(audio_path),
+                "-map", "0:v:0", "-map", "1:a:0",
+                "-c", "copy", "-movflags", "+faststart",
+                str(out),
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        stage_seconds.observe(time.perf_counter() - started, stage="mux", format=format_id)
+        return out
+    finally:
+        shutil.rmtree(parts, ignore_errors=True)
+
+
+def probe_duration(path: Path) -> Optional[float]:
+    """Длительность файла по ffprobe; None — узнать нечем."""
+    if not FFPROBE:
+        return None
+    out = subprocess.run(
+        [FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)],
+        capture_output=True,
+        text=True,
+    )
+    try:
+        return float(out.stdout.strip())
+    except ValueError:
+        return None
+
+
+def split_for_upload(
+    path: Path,
+    out_dir: Path,
+    max_bytes: int,
+    duration: Optional[float] = None,
+) -> List[Path]:
+    """
+    Режет файл на части не больше max_bytes сегмент-муксером ffmpeg
+    без перекодирования (-c copy). Длина части по времени считается из
+    средней скорости потока; ffmpeg режет по ключевым кадрам, поэтому
+    если часть всё же вышла больше лимита — режем заново мельче.
+    """
+    duration = duration or probe_duration(path)
+    if not FFMPEG or not duration:
+        raise RuntimeError("нечем нарезать файл: нет ffmpeg или длительности")
+
+    size = path.stat().st_size
+    segment = duration * max_bytes * SPLIT_HEADROOM / size
+    # у mp4/m4a каждую часть — с moov в начале, как и склеенные файлы
+    mp4_opts = (
+        ["-segment_format_options", "movflags=+faststart"]
+        if path.suffix.lower() in (".mp4", ".m4a", ".mov")
+        else []
+    )
+    started = time.perf_counter()
+    for _ in range(3):
+        for old in out_dir.iterdir():
+            old.unlink()
+        # "%" в названии ролика ffmpeg принял бы за номер части
+        stem = path.stem.replace("%", "%%")
+        pattern = out_dir / f"{stem}.part%03d{path.suffix}"
+        subprocess.run(
+            [
+                FFMPEG, "-v", "error", "-y", "-i", str(path),
+                "-map", "0", "-c", "copy",
+                "-f", "segment", "-segment_time", f"{segment:.3f}",
+                "-reset_timestamps", "1",
+                *mp4_opts,
+                str(pattern),
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        parts = sorted(out_dir.iterdir())
+        largest = max(p.stat().st_size for p in parts)
+        if largest <= max_bytes:
+            stage_seconds.observe(time.perf_counter() - started, stage="split")
+            return parts
+        segment *= max_bytes * SPLIT_HEADROOM / largest
+    raise RuntimeError(f"не удалось нарезать файл на части до {max_bytes} байт")
+
+
+async def download_to_dir(
+    url: str,
+    format_id: str,
+    download_dir: Path,
+    user_id: int,
+    on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    audio: bool = False,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Path:
+    """
+    Качает один выбранный формат в указанный каталог через очередь загрузок.
+    audio=True — формат только со звуком: дорожка перекладывается в m4a/opus.
+    on_queued(позиция) вызывается, если загрузка не стартовала сразу.
+    on_progress — progress_hook yt-dlp, зовётся из потока скачивания.
+    Профиль сетевого движка берётся по формату из кэша метаданных.
+    Возвращает путь к локальному файлу.
+    """
+    video_id = extract_video_id(url)
+    found = find_cached_format(video_id, format_id) if video_id else None
+    fmt = found[1] if found else None
+    profile = choose_profile(fmt)
+    target = None
+    if audio or (fmt and is_audio_only(fmt)):
+        # кодек неизвестен (метаданные истекли) — "best": ffmpeg сам
+        # выберет контейнер под кодек и тоже скопирует дорожку
+        target = (audio_target(fmt) if fmt else None) or "best"
+    fn = _download_merged if "+" in format_id else _download_to
+    return await scheduler.run_download(
+        user_id, fn, url, format_id, download_dir, profile, target, on_progress,
+        on_queued=on_queued,
+    )
 
-    return await loop.run_in_executor(None, _download)